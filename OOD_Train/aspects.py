@@ -0,0 +1,182 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+    PyRailSim
+    Copyright (C) 2019  Zezhou Wang
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class AspectCore():
+    """
+        Optional vectorized aspects of all signals of a System.
+        Enabled by System(..., vectorized_aspects=True).
+
+        Arrays indexed by track id (the index in System.tracks):
+            occupied: whether a train occupies the track, updated by
+                System.occupancy_changed;
+            successor: the next track along the current routing path of the
+                track, -1 at the end of the path.
+        Arrays indexed by signal id (see signal_id):
+            routed, exiting: Signal.route and
+                Signal.cleared_signal_to_exit_system;
+            first: the first track ahead of the signal (Signal.tracks_ahead),
+                -1 if none;
+            next_exiting, next_next_exiting: whether the next and the next
+                but one enroute signals are cleared to exit the system.
+        The routing arrays are compiled again when System.routing_version
+        changes. The colors of all signals are then computed in one pass
+        whenever System.state_version changes, by the look-ahead of up to 3
+        cleared blocks along the successors, with the same rules as
+        Signal.aspect. Without NumPy, the colors are the ones of the object
+        model."""
+
+    COLORS = ['r', 'y', 'yy', 'g']
+    # colors by code of the vectorized pass, see Aspect.COLOR_SPD_DICT
+    LOOK_AHEAD = 3
+    # blocks cleared ahead beyond which the aspect is 'g'
+
+    def __init__(self, system):
+        self.system = system
+        self.track_id = {t: i for i, t in enumerate(system.tracks)}
+        self.signals = [sig for p in system.signal_points
+                        for sig in p.signal_by_port.values()]
+        self.signal_id = {sig: i for i, sig in enumerate(self.signals)}
+        self._routing_version = None
+        self._state_version = None
+        self._routes = [None] * len(self.signals)
+        self._colors = None
+        if np is not None:
+            self.occupied = np.array(
+                [bool(t.train) for t in system.tracks] + [True], dtype=bool)
+            # the last entry stands for "no track": never cleared
+            self.successor = np.full(len(system.tracks) + 1, -1, dtype=np.int64)
+            self._color_array = np.array(self.COLORS, dtype=object)
+
+    def occupancy_changed(self, tracks):
+        '''
+            Update the occupancy of the tracks entered/exited by a train.
+            @return: None'''
+        if np is None:
+            return
+        for t in tracks:
+            if t is not None:
+                self.occupied[self.track_id[t]] = bool(t.train)
+
+    def compile_routing(self):
+        '''
+            Compile the routing arrays from the current routing paths and
+            routes of the signals.
+            @return: None'''
+        _track_id, _sys = self.track_id, self.system
+        _successor = np.full(len(_sys.tracks) + 1, -1, dtype=np.int64)
+        _ids_by_path = {}
+        for rp in _sys.curr_routing_paths:
+            _ids = [_track_id.get(_sys.get_track_by_point_port_pairs(
+                p1, p1port, p2, p2port), -1)
+                for ((p1, p1port), (p2, p2port)) in rp]
+            _ids_by_path[id(rp)] = _ids
+            _tracks = [i for i in _ids if i >= 0]
+            for i, j in zip(_tracks, _tracks[1:]):
+                if _successor[i] < 0:
+                    _successor[i] = j
+                    # the first routing path of a routing, as
+                    # System.routing_path_by_routing
+        _n = len(self.signals)
+        _routed = np.zeros(_n, dtype=bool)
+        _exiting = np.zeros(_n, dtype=bool)
+        _first = np.full(_n, -1, dtype=np.int64)
+        _next_exiting = np.zeros(_n, dtype=bool)
+        _next_next_exiting = np.zeros(_n, dtype=bool)
+        for i, sig in enumerate(self.signals):
+            self._routes[i] = sig.route
+            if not self._routes[i]:
+                continue
+            _routed[i] = True
+            if sig.cleared_signal_to_exit_system:
+                _exiting[i] = True
+                continue
+            _first[i] = self.first_track_ahead(sig, _ids_by_path)
+            _next = sig.next_enroute_signal
+            if _next is None:
+                continue
+            _next_exiting[i] = _next.cleared_signal_to_exit_system
+            if _next.permit_track:
+                _next_next_exiting[i] = \
+                    _next.next_enroute_signal.cleared_signal_to_exit_system
+        _first[_first < 0] = len(_sys.tracks)
+        _successor[_successor < 0] = len(_sys.tracks)
+        self.successor = _successor
+        (self.routed, self.exiting, self.first, self.next_exiting,
+         self.next_next_exiting) = (_routed, _exiting, _first, _next_exiting,
+                                    _next_next_exiting)
+        self._routing_version = _sys.routing_version
+
+    def first_track_ahead(self, sig, ids_by_path):
+        '''
+            Track id of the first track of Signal.tracks_ahead, -1 if none.'''
+        _rp = sig.curr_routing_path
+        if not _rp:
+            return -1
+        _ids = ids_by_path[id(_rp)]
+        _start = _rp.index(sig.governed_track.routing) + 1 \
+            if sig.governed_track else 1
+        return next((i for i in _ids[_start:] if i >= 0), -1)
+
+    def compute(self):
+        '''
+            Colors of all signals in one vectorized pass.
+            @return: None'''
+        _ahead = [self.first]
+        for _ in range(self.LOOK_AHEAD - 1):
+            _ahead.append(self.successor[_ahead[-1]])
+        _blocked = self.occupied[np.stack(_ahead, axis=1)]
+        _cleared = np.where(_blocked.any(axis=1), _blocked.argmax(axis=1),
+                            self.LOOK_AHEAD)
+        _codes = np.select(
+            [~self.routed, self.exiting, _cleared == 0, _cleared == 1,
+             _cleared == 2],
+            [0, 3, 0, np.where(self.next_exiting, 3, 1),
+             np.where(self.next_next_exiting, 3, 2)], default=3)
+        self._colors = self._color_array[_codes]
+        self._state_version = self.system.state_version
+
+    def aspect_state(self, sig):
+        '''
+            (color, route) of the aspect of a signal, from the snapshot of the
+            current state of the System.'''
+        if np is None:
+            return sig.current_color(), sig.route
+        if self._routing_version != self.system.routing_version:
+            self.compile_routing()
+            self._state_version = None
+        if self._state_version != self.system.state_version:
+            self.compute()
+        _i = self.signal_id[sig]
+        return self._colors[_i], self._routes[_i]
+
+    def snapshot(self):
+        '''
+            Colors of all signals, in the order of signals.
+            @return: list of str'''
+        if np is None:
+            return [sig.aspect.color for sig in self.signals]
+        if self.signals:
+            self.aspect_state(self.signals[0])
+        return list(self._colors) if self.signals else []
@@ -0,0 +1,218 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+    PyRailSim
+    Copyright (C) 2019  Zezhou Wang
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import contextlib
+import multiprocessing
+import os
+import random
+from collections import namedtuple
+from datetime import datetime
+from itertools import product
+
+from dispatch import Dispatcher
+from system import System
+
+TrainResult = namedtuple('TrainResult', [
+    'train_idx', 'max_spd', 'max_acc', 'max_dcc', 'init_time', 'term_time',
+    'terminated', 'crossing_times'
+])
+# compact record of one train returned by the workers.
+# crossing_times: {MP: first recorded time beyond MP} of the checkpoints
+
+
+def scenario_grid(headways, dos_positions=(None,), dos_periods=((),),
+                  seeds=(0,), **common):
+    '''
+        Build the list of scenarios (dict) of all combinations of headways,
+        DoS positions, DoS periods and random seeds. Other keyword arguments
+        are shared by all scenarios:
+        ----------
+        :init_time: str, "%Y-%m-%d %H:%M:%S". '2018-01-10 10:00:00' by default.
+        :duration: seconds of the simulation. 2.5 hours by default.
+        :refresh_time: int, seconds. 50 by default.
+        :checkpoints: list of MPs to record the crossing times of trains.'''
+    return [dict(common, headway=hw, dos_pos=pos, dos_period=list(prd),
+                 seed=seed)
+            for hw, pos, prd, seed in product(headways, dos_positions,
+                                              dos_periods, seeds)]
+
+
+def crossing_time(train, MP):
+    '''
+        First recorded time of the train beyond the MP along its direction.
+        None if never recorded.'''
+    for (t, pos) in train.time_pos_list:
+        if (pos > MP if train.downtrain else pos < MP):
+            return t
+    return None
+
+
+def build_system(scenario):
+    '''
+        Build the System of a scenario. The speed, acceleration and
+        deceleration containers are randomized by the seed of the scenario,
+        the same way as sim.simulation_setup.'''
+    random.seed(scenario.get('seed'))
+    _init_time = datetime.strptime(
+        scenario.get('init_time', '2018-01-10 10:00:00'), "%Y-%m-%d %H:%M:%S")
+    spd_container = [random.uniform(0.01, 0.02) for i in range(20)]
+    acc_container = [0.5*random.uniform(2.78e-05*0.85, 2.78e-05*1.15)
+                     for i in range(20)]
+    dcc_container = [0.2*random.uniform(2.78e-05*0.85, 2.78e-05*1.15)
+                     for i in range(20)]
+    sys = System(_init_time, spd_container, acc_container, dcc_container,
+                 dos_period=scenario.get('dos_period', []),
+                 dos_pos=scenario.get('dos_pos'),
+                 headway=scenario.get('headway'),
+                 refresh_time=scenario.get('refresh_time', 50))
+    Dispatcher(sys)
+    return sys
+
+
+def launch_system(sys, scenario, launch_duration):
+    '''
+        Launch the System of a scenario, silencing its prints unless the
+        scenario has quiet=False.'''
+    with open(os.devnull, 'w') as _devnull:
+        with contextlib.redirect_stdout(_devnull) \
+                if scenario.get('quiet', True) else contextlib.nullcontext():
+            sys.launch(launch_duration, auto_generate_train=True)
+
+
+def compact_results(sys, scenario):
+    '''
+        {'scenario': scenario, 'trains': [TrainResult, ...]} of a System.'''
+    return {'scenario': scenario,
+            'trains': [TrainResult(t.train_idx, t.max_spd, t.max_acc,
+                                   t.max_dcc, getattr(t, 'init_time', None),
+                                   max([tm for (tm, _) in t.time_pos_list])
+                                   if t.terminated else None,
+                                   t.terminated,
+                                   {MP: crossing_time(t, MP) for MP in
+                                    scenario.get('checkpoints', [])})
+                       for t in sys.trains.history]}
+
+
+def run_scenario(scenario):
+    '''
+        Run one System scenario and return its compact results.'''
+    sys = build_system(scenario)
+    launch_system(sys, scenario, scenario.get('duration', 9000))
+    return compact_results(sys, scenario)
+
+
+def run_branches(scenario, branches):
+    '''
+        Run a scenario until its DoS starts, then fork the System into one
+        branch per dict of branches (dos_pos/dos_period/headway overriding the
+        scenario) and run each branch to the end from the shared state.
+        The random state at the fork is restored for every branch.
+        @return: list of compact results, one per branch.'''
+    sys = build_system(scenario)
+    _fork_time = min([sys.dos_period[0]] + [
+        datetime.strptime(b['dos_period'][0], "%Y-%m-%d %H:%M:%S").timestamp()
+        for b in branches if b.get('dos_period')]) \
+        if sys.dos_period else sys.init_time
+    # every refreshing cycle before the earliest attack is shared
+    launch_system(sys, scenario, _fork_time - sys.init_time - sys.refresh_time)
+    _random_state = random.getstate()
+    _results = []
+    for b in branches:
+        _branch = sys.fork(**b)
+        random.setstate(_random_state)
+        launch_system(_branch, scenario, scenario.get('duration', 9000))
+        _results.append(compact_results(_branch, dict(scenario, **b)))
+    return _results
+
+
+class BatchAggregator():
+    """
+        Aggregates the results of scenarios as they stream in, grouped by the
+        scenario parameters except the seed."""
+
+    def __init__(self):
+        self.runs = 0
+        self.groups = {}
+
+    @staticmethod
+    def group_key(scenario):
+        return tuple(sorted((k, str(v)) for k, v in scenario.items()
+                            if k != 'seed'))
+
+    def add(self, result):
+        self.runs += 1
+        _group = self.groups.setdefault(
+            self.group_key(result['scenario']),
+            {'runs': 0, 'trains': 0, 'terminated': 0, 'travel_time': 0.0})
+        _group['runs'] += 1
+        for trn in result['trains']:
+            _group['trains'] += 1
+            if trn.terminated and trn.init_time is not None:
+                _group['terminated'] += 1
+                _group['travel_time'] += trn.term_time - trn.init_time
+
+    def summary(self):
+        '''
+            Per group: runs, average trains generated and terminated per run,
+            and average travel time of terminated trains in seconds.'''
+        return {key: {'runs': g['runs'],
+                      'avg_trains': g['trains'] / g['runs'],
+                      'avg_terminated': g['terminated'] / g['runs'],
+                      'avg_travel_time': g['travel_time'] / g['terminated']
+                      if g['terminated'] else None}
+                for key, g in self.groups.items()}
+
+
+def run_batch(scenarios, workers=None, chunksize=1, aggregator=None,
+              callback=None):
+    '''
+        Run the scenarios on a pool of worker processes and aggregate their
+        results as they complete (in any order).
+        ----------
+        :workers: int, number of processes. os.cpu_count() by default.
+            With 1 worker, the scenarios run in the current process.
+        :chunksize: int, scenarios sent to a worker at a time.
+        :aggregator: object with an add(result) method. BatchAggregator()
+            by default.
+        :callback: callable, called with each result as it completes.
+        @return: the aggregator.'''
+    aggregator = BatchAggregator() if aggregator is None else aggregator
+    if workers == 1:
+        _results = map(run_scenario, scenarios)
+        for result in _results:
+            aggregator.add(result)
+            if callback: callback(result)
+        return aggregator
+    with multiprocessing.Pool(processes=workers) as pool:
+        for result in pool.imap_unordered(run_scenario, scenarios,
+                                          chunksize=chunksize):
+            aggregator.add(result)
+            if callback: callback(result)
+    return aggregator
+
+
+if __name__ == '__main__':
+    grid = scenario_grid(headways=[400, 500, 600],
+                         dos_positions=[None],
+                         dos_periods=[['2018-01-10 11:30:00',
+                                       '2018-01-10 12:30:00']],
+                         seeds=range(4), duration=3600, checkpoints=[20])
+    agg = run_batch(grid, chunksize=2)
+    for key, stats in agg.summary().items():
+        print(dict(key), stats)
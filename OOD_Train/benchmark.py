@@ -0,0 +1,287 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+    PyRailSim
+    Copyright (C) 2019  Zezhou Wang
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import random
+import time
+from datetime import datetime
+from itertools import product
+
+import networkx as nx
+
+from dispatch import Dispatcher
+from network_constructor import generate_network
+from system import System
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def benchmark_grid(num_points=(10, 100, 1000),
+                   siding_spacings=(None, 10, 2), headways=(300, 600),
+                   max_sidings=9, **common):
+    '''
+        Build the list of benchmark configurations (dict) of all combinations
+        of corridor sizes (SignalPoints of the main line), siding spacings and
+        headways. Corridors of more than max_sidings sidings are left out: the
+        Dispatcher enumerates all the routes of a train through the sidings
+        ahead, 2 ** sidings of them. Other keyword arguments are shared by all
+        configurations:
+        ----------
+        :duration: seconds of simulation launched. 3600 by default.
+        :refresh_time: int, seconds. 50 by default.
+        :block_length: miles between two SignalPoints. 5.0 by default, as
+            the test network: trains must not run through more than a block
+            per refreshing cycle.
+        :siding_length: int, blocks of a siding. 1 by default.
+        :branch_count: int, branch lines of the corridor. 0 by default.
+        :vectorized_kinematics: bool. False by default.
+        :vectorized_aspects: bool. False by default.
+        :seed: random seed of the train parameters. 0 by default.'''
+    return [dict(common, num_points=n, siding_spacing=s, headway=h)
+            for n, s, h in product(num_points, siding_spacings, headways)
+            if num_sidings(n, s, common.get('siding_length', 1))
+            <= max_sidings]
+
+
+def num_sidings(num_points, siding_spacing, siding_length=1):
+    '''
+        Number of sidings of a corridor built by run_config.'''
+    return 0 if siding_spacing is None else len(range(
+        siding_spacing, num_points - 1 - siding_length, siding_spacing))
+
+
+def peak_memory():
+    '''
+        Peak resident memory of the current process in bytes. None if the
+        platform has no resource module.'''
+    if resource is None:
+        return None
+    _maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return _maxrss if platform.system() == 'Darwin' else _maxrss * 1024
+    # ru_maxrss is in bytes on macOS, in kilobytes elsewhere
+
+
+def run_config(config):
+    '''
+        Build the corridor System of a configuration, launch it with a
+        TickProfiler and measure it. Trains run along the main line. A failing
+        simulation is reported with status 'error' and the measurements up to
+        the failure.
+        @return: dict of the measurements'''
+    random.seed(config.get('seed', 0))
+    _start = time.perf_counter()
+    _spec = generate_network(config['num_points'] - 1,
+                             siding_spacing=config.get('siding_spacing'),
+                             siding_length=config.get('siding_length', 1),
+                             branch_count=config.get('branch_count', 0),
+                             block_length=config.get('block_length', 5.0))
+    sys = System(datetime(2018, 1, 10, 10, 0, 0),
+                 dos_period=[],
+                 headway=config.get('headway'),
+                 refresh_time=config.get('refresh_time', 50),
+                 network=_spec,
+                 vectorized_kinematics=config.get('vectorized_kinematics'),
+                 vectorized_aspects=config.get('vectorized_aspects'),
+                 profile=True)
+    Dispatcher(sys)
+    _result = {'config': config, 'status': 'ok', 'error': None,
+               'signal_points': len(sys.signal_points),
+               'ctrl_points': len(sys.ctrl_points),
+               'tracks': len(sys.tracks),
+               'build_time': time.perf_counter() - _start}
+    _start = time.perf_counter()
+    try:
+        with open(os.devnull, 'w') as _devnull:
+            with contextlib.redirect_stdout(_devnull):
+                sys.launch(config.get('duration', 3600),
+                           auto_generate_train=True,
+                           init_pointport=(sys.signal_points[0], 0),
+                           dest_pointport=(
+                               sys.signal_points[config['num_points'] - 1], 1))
+    except Exception as e:
+        _result['status'], _result['error'] = 'error', repr(e.__context__ or e)
+        # System.refresh_cycle chains the original error of the trains
+    _launch_time = time.perf_counter() - _start
+    _report = sys.profiler.report()
+    _result.update({
+        'launch_time': _launch_time,
+        'ticks': _report['ticks'],
+        'ticks_per_sec': _report['ticks'] / _launch_time
+        if _launch_time else None,
+        'tick_wall_time': _report['tick_wall_time'],
+        'phases': _report['phases'],
+        'calls': _report['calls'],
+        'paths_enumerated': _report['paths_enumerated'],
+        'trains': sys.trains.generated,
+        'terminated': len(sys.trains.retired) +
+        len([t for t in sys.trains.all_trains if t.terminated]),
+        'peak_memory': peak_memory()})
+    return _result
+
+
+def check_corridors(duration=6 * 3600):
+    '''
+        Launch small corridors of generate_network (a plain line and lines
+        with sidings) with trains every 300 seconds, and check that they run
+        for some simulated hours without error and that trains terminate.
+        @return: list of the results (see run_config)'''
+    _results = [run_config(dict(num_points=n, siding_spacing=s, headway=300,
+                                duration=duration, refresh_time=50,
+                                block_length=5.0))
+                for n, s in ((10, None), (10, 3), (30, 10))]
+    _failed = [r for r in _results
+               if r['status'] != 'ok' or not r['terminated']]
+    if _failed:
+        raise RuntimeError('corridors failed: {}'.format(
+            ['{num_points} points, siding spacing {siding_spacing}'.format(
+                **r['config']) + ': ' + (r['error'] or 'no train terminated')
+             for r in _failed]))
+    return _results
+
+
+def _run_config_to_queue(config, results):
+    results.put(run_config(config))
+
+
+def run_isolated(config, timeout=None):
+    '''
+        Run a configuration in a new process, so that its peak memory is its
+        own. The process is terminated after timeout seconds, reported with
+        status 'timeout'.
+        @return: dict of the measurements'''
+    _results = multiprocessing.Queue()
+    _proc = multiprocessing.Process(target=_run_config_to_queue,
+                                    args=(config, _results))
+    _proc.start()
+    _deadline = None if timeout is None else time.monotonic() + timeout
+    try:
+        while True:
+            try:
+                return _results.get(timeout=1)
+            except queue.Empty:
+                pass
+            if not _proc.is_alive():
+                try:
+                    return _results.get(timeout=1)
+                except queue.Empty:
+                    return {'config': config, 'status': 'crashed',
+                            'error': 'exit code {}'.format(_proc.exitcode)}
+            if _deadline is not None and time.monotonic() > _deadline:
+                _proc.terminate()
+                return {'config': config, 'status': 'timeout',
+                        'error': 'no result after {}s'.format(timeout)}
+    finally:
+        _proc.join()
+
+
+def run_benchmark(configs, timeout=None, output=None, isolated=True):
+    '''
+        Run the configurations one by one (never in parallel, not to disturb
+        the timings) and store the results as JSON, rewritten after each
+        configuration.
+        ----------
+        :timeout: seconds allowed per configuration. No limit if None.
+        :output: path of the JSON file. Not written if None.
+        :isolated: run each configuration in its own process. Otherwise,
+            timeout is ignored and peak_memory is the one of the process.
+        @return: dict {'environment': {...}, 'results': [...]}'''
+    _benchmark = {'environment': {
+        'time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'networkx': nx.__version__}, 'results': []}
+    for config in configs:
+        _result = run_isolated(config, timeout) if isolated \
+            else run_config(config)
+        _benchmark['results'].append(_result)
+        print('{num_points:>6} points, siding spacing {siding_spacing}, '
+              'headway {headway}: '.format(**config) + _result['status'] +
+              (', {:.1f} ticks/s, {} trains'.format(_result['ticks_per_sec'],
+                                                    _result['trains'])
+               if _result.get('ticks_per_sec') else ''))
+        if output:
+            with open(output, 'w') as f:
+                json.dump(_benchmark, f, indent=1)
+    return _benchmark
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Scalability benchmark of System.launch over synthetic '
+                    'corridors.')
+    parser.add_argument('--points', type=int, nargs='+',
+                        default=[10, 100, 1000],
+                        help='numbers of SignalPoints of the corridors')
+    parser.add_argument('--sidings', type=int, nargs='+', default=[0, 10, 2],
+                        help='siding spacings in SignalPoints, 0: no sidings')
+    parser.add_argument('--max-sidings', type=int, default=9,
+                        help='leave out corridors of more sidings')
+    parser.add_argument('--siding-length', type=int, default=1,
+                        help='blocks of a siding')
+    parser.add_argument('--branches', type=int, default=0,
+                        help='branch lines of the corridors')
+    parser.add_argument('--headways', type=int, nargs='+', default=[300, 600],
+                        help='headways of trains in seconds')
+    parser.add_argument('--duration', type=int, default=3600,
+                        help='seconds of simulation per configuration')
+    parser.add_argument('--refresh-time', type=int, default=50)
+    parser.add_argument('--block-length', type=float, default=5.0,
+                        help='miles between two SignalPoints')
+    parser.add_argument('--vectorized', action='store_true',
+                        help='use the vectorized kinematics')
+    parser.add_argument('--vectorized-aspects', action='store_true',
+                        help='use the vectorized aspects')
+    parser.add_argument('--timeout', type=float, default=600,
+                        help='seconds allowed per configuration, 0: no limit')
+    parser.add_argument('-o', '--output', default='benchmark_results.json')
+    parser.add_argument('--check', action='store_true',
+                        help='only check that small generated corridors run '
+                             'and terminate trains')
+    args = parser.parse_args()
+    if args.check:
+        for r in check_corridors():
+            print('{num_points:>6} points, siding spacing {siding_spacing}: '
+                  .format(**r['config']) + '{} trains, {} terminated'
+                  .format(r['trains'], r['terminated']))
+        raise SystemExit
+    _benchmark = run_benchmark(
+        benchmark_grid(args.points, [s or None for s in args.sidings],
+                       args.headways, max_sidings=args.max_sidings,
+                       duration=args.duration,
+                       refresh_time=args.refresh_time,
+                       block_length=args.block_length,
+                       siding_length=args.siding_length,
+                       branch_count=args.branches,
+                       vectorized_kinematics=args.vectorized,
+                       vectorized_aspects=args.vectorized_aspects),
+        timeout=args.timeout or None, output=args.output)
+    _failed = [r for r in _benchmark['results']
+               if r['status'] in ('error', 'crashed')]
+    if _failed:
+        raise SystemExit('{} configurations failed: {}'.format(
+            len(_failed), [r['error'] for r in _failed]))
@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+    PyRailSim
+    Copyright (C) 2019  Zezhou Wang
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import heapq
+from itertools import count
+
+
+class Event():
+    """
+        A future happening of the simulation, executed by calling its action.
+        Events are ordered by time first, then by priority (lower first), then
+        by the order they were scheduled in."""
+
+    def __init__(self, time, action, priority=0, name=None, seq=0):
+        self.time = time
+        self.action = action
+        self.priority = priority
+        self.name = name if name else getattr(action, '__name__', 'event')
+        self.seq = seq
+        self.cancelled = False
+
+    def __repr__(self):
+        return 'Event <{}> at {} priority:{}'.format(
+            self.name, self.time, self.priority)
+
+    def __lt__(self, other):
+        return (self.time, self.priority, self.seq) < \
+            (other.time, other.priority, other.seq)
+
+
+class EventQueue():
+    """
+        Priority queue of future Events of a simulation System: the next
+        fixed-step refreshing cycle and actions scheduled by the user. Trains
+        are not scheduled individually; they move within refreshing cycles.
+        Cancelled events stay in the heap and are dropped when they surface."""
+
+    def __init__(self):
+        self._heap = []
+        self._seq = count()
+
+    def __len__(self):
+        return len([e for e in self._heap if not e.cancelled])
+
+    def __bool__(self):
+        return self.next_time is not None
+
+    def schedule(self, time, action, priority=0, name=None):
+        '''
+            Schedule an action to be called at the given time.
+            @return: the Event instance, which can be cancelled later.'''
+        _event = Event(time, action, priority=priority, name=name,
+                       seq=next(self._seq))
+        heapq.heappush(self._heap, _event)
+        return _event
+
+    def cancel(self, event):
+        event.cancelled = True
+
+    @property
+    def next_time(self):
+        '''
+            Time of the earliest pending event. None if the queue is empty.'''
+        while self._heap and self._heap[0].cancelled:
+            heapq.heappop(self._heap)
+        return self._heap[0].time if self._heap else None
+
+    def pop(self):
+        '''
+            Remove and return the earliest pending event.'''
+        if self.next_time is None:
+            raise IndexError('pop from an empty EventQueue')
+        return heapq.heappop(self._heap)
+
+    def clear(self):
+        self._heap = []
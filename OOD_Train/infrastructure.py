@@ -35,10 +35,18 @@ class Track(Observable):
     def sign_routing(rp_seg):
         '''
             Return the sign (+1/-1) of traffic when input with a legal routing 
-            path segment of a track/bigblock (describing traffic direction)'''
+            path segment of a track/bigblock (describing traffic direction)
+            Looked up in System.sign_by_segment once the System is frozen.'''
         if not rp_seg:  # no routing information (dormant track/bigblock)
             return 0
-        elif rp_seg[0][0] and rp_seg[1][0]:
+        _signs = (rp_seg[0][0] or rp_seg[1][0]).system.sign_by_segment
+        _sign = _signs.get(rp_seg) if _signs is not None else None
+        return _sign if _sign is not None \
+            else Track.compute_sign_routing(rp_seg)
+
+    @staticmethod
+    def compute_sign_routing(rp_seg):
+        if rp_seg[0][0] and rp_seg[1][0]:
             if rp_seg[1][0].signal_by_port[rp_seg[1][1]].MP > \
                     rp_seg[0][0].signal_by_port[rp_seg[0][1]].MP:
                 return 1
@@ -104,6 +112,9 @@ class Track(Observable):
         self.tracks = []
         self.__bigblock = None
         self.__curr_routing_path = None
+        self._frozen_MP = None
+        self._frozen_length = None
+        # static MP and length, kept by freeze
 
     def __repr__(self):
         return 'Track <MP:{0}~{1}> <{2} port:{3}~{4} port:{5}> key:{6}'\
@@ -117,13 +128,24 @@ class Track(Observable):
 
     @property
     def MP(self):
+        if self._frozen_MP is not None:
+            return self._frozen_MP
         return (self.L_point.signal_by_port[self.L_point_port].MP,
                 self.R_point.signal_by_port[self.R_point_port].MP)
 
     @property
     def length(self):
+        if self._frozen_length is not None:
+            return self._frozen_length
         return abs(self.MP[1] - self.MP[0])
 
+    def freeze(self):
+        '''
+            Keep the MP and length of the track, see System.freeze.
+            @return: None'''
+        self._frozen_MP = self.MP
+        self._frozen_length = self.length
+
     @property
     def train(self):
         return self._train
@@ -160,13 +182,11 @@ class Track(Observable):
             self._routing = new_routing
         else:
             self._routing = None
+        self.system.routing_version += 1
 
     @property
     def curr_routing_path(self):
-        for rp in self.system.curr_routing_paths:
-            if self.routing in rp:
-                return rp
-        return None
+        return self.system.routing_path_by_routing(self.routing)
 
     def shooting_point(self, point=None, port=None, sign_MP=None):
         if point is not None:
@@ -287,6 +307,8 @@ class BigBlock(Track):
             self._routing = None
             for t in self.tracks:
                 t.routing = None
+        self.system.state_version += 1
+        self.system.routing_version += 1
 
     @property
     def curr_routing_path(self):
@@ -0,0 +1,280 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+    PyRailSim
+    Copyright (C) 2019  Zezhou Wang
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class KinematicsCore():
+    """
+        Optional vectorized kinematics of all running trains of a System.
+        Enabled by System(..., vectorized_kinematics=True).
+
+        At each refreshing cycle, positions, speeds, accelerations, speed
+        limits and target speeds of the running trains are gathered into NumPy
+        arrays (struct of arrays). The acceleration decisions (hold, accelerate,
+        brake) and the position updates are computed in one pass, following the
+        same rules as Train.curr_acc, Train.curr_speed and Train.curr_MP.
+        Trains whose head or rear crosses a SignalPoint in the cycle are handed
+        back to the object model (Train.update_acc).
+
+        Ordering: the System still requests routing and updates each train in
+        turn (Train.request_routing, then update), as without this core, so
+        that routing decisions (and their random choices) are the same. The
+        arrays are solved once per cycle beforehand (prepare); at its turn, a
+        train takes its solved result only if its state is still the one
+        gathered, otherwise it is updated by the object model. Only the
+        routings and the aspects can change under a train before its turn:
+        its target speed is kept per train (target) until the routing_version
+        of the System, the signal ahead, its color or the track of the train
+        change, and the rest of its state is gathered again only after a
+        change of routings.
+        Cycles with fewer than MIN_TRAINS running trains are left to the
+        object model: the arrays would cost more than they save.
+        Without NumPy, trains are updated by the object model only."""
+
+    MIN_TRAINS = 8
+    # running trains of a cycle from which the arrays are solved
+
+    def __init__(self, system):
+        self.system = system
+        self._rows = {}
+        self._results = {}
+        self._targets = {}
+        # {train: (key, target speed)}, see target
+        self._routing_version = None
+        # routing_version of the System when the rows were gathered
+
+    def prepare(self, trains):
+        '''
+            Solve the kinematics of the running trains of the cycle, from their
+            state before any of them is updated.
+            @return: None'''
+        if np is None or len(trains) < self.MIN_TRAINS:
+            self._rows, self._results, self._targets = {}, {}, {}
+            return
+        self._targets = {t: self._targets[t] for t in trains
+                         if t in self._targets}
+        # drop the trains which are terminated or idle
+        self._routing_version = self.system.routing_version
+        _rows = {t: self.row(t) for t in trains}
+        self._rows = {t: r for t, r in _rows.items() if r is not None}
+        self._results = self.solve(self.arrays(self._rows)) \
+            if self._rows else {}
+
+    def update(self, t):
+        '''
+            Update the kinematics of a train for the cycle: its solved result
+            if its state is unchanged since prepare, Train.update_acc otherwise.
+            @return: None'''
+        _row = self._rows.pop(t, None)
+        _result = self._results.pop(t, None)
+        if _row is not None and self.unchanged(t, _row) and \
+                self.commit(t, _result):
+            return
+        t.update_acc()
+
+    def unchanged(self, t, row):
+        '''
+            True if the state of a train is still its row gathered by prepare.
+            Without a change of routings since, only its target speed may have
+            changed (by the aspect of the signal ahead).'''
+        if self.system.routing_version != self._routing_version:
+            return row == self.row(t)
+        return self.target(t) == row[4]
+
+    def target(self, t):
+        '''
+            Train.curr_target_spd_abs, kept until the routing_version of the
+            System, the signal ahead, its color or the track of the train
+            change.'''
+        _sig = t.curr_sig
+        _key = (self.system.routing_version, _sig, t.curr_track,
+                _sig.aspect.color if _sig else None)
+        _target = self._targets.get(t)
+        if _target is None or _target[0] != _key:
+            _target = self._targets[t] = (_key, t.curr_target_spd_abs)
+        return _target[1]
+
+    def row(self, t):
+        '''
+            State of a moving train (not stopped) as input of solve, None if
+            the train is terminated or stopped.'''
+        if t.terminated:
+            return None
+        _tgt = self.target(t)
+        if t._curr_speed == 0 and _tgt == 0:
+            return None     # stopped trains only append their records
+        _sign = t.curr_sign
+        _sig = t.curr_sig
+        return (t._curr_MP, t._curr_speed, t._curr_acc, t._curr_spd_lmt_abs,
+                _tgt, _sig.MP if _sig else _sign * float('inf'), _sign,
+                t.max_acc, t.max_dcc, isinstance(t._curr_speed, int),
+                isinstance(t._curr_acc, int))
+
+    @staticmethod
+    def arrays(rows):
+        '''
+            Struct of arrays of the rows of the trains.
+            @return: dict of arrays'''
+        _cols = ['MP', 'spd', 'acc', 'lmt', 'tgt', 'tgt_MP', 'sign',
+                 'max_acc', 'max_dcc', 'spd_int', 'acc_int']
+        _states = {c: np.array([r[i] for r in rows.values()],
+                               dtype=bool if c.endswith('_int') else float)
+                   for i, c in enumerate(_cols)}
+        # *_int: int values (literal zeros) are kept int as the object model
+        _states['trains'] = list(rows)
+        return _states
+
+    def solve(self, s):
+        '''
+            Vectorized Train.update_acc of the moving trains, without crossing
+            any SignalPoints.
+            @return: {train: (acc, speed, delta_s)}'''
+        r = self.system.refresh_time
+        with np.errstate(invalid='ignore', over='ignore'):
+            _acc1, _acc1_int = self.decide(
+                s['MP'], s['spd'], s['acc'], s['acc_int'], s['lmt'], s['tgt'],
+                s['tgt_MP'], s['sign'], s['max_acc'], s['max_dcc'], r)
+            _spd, _spd_int = self.new_speed(
+                s['spd'], s['spd'] + _acc1 * r,
+                s['spd_int'] & _acc1_int & isinstance(r, int), s['lmt'],
+                s['tgt'])
+            # the acceleration is decided again at the new speed
+            _acc2, _acc2_int = self.decide(
+                s['MP'], _spd, _acc1, _acc1_int, s['lmt'], s['tgt'],
+                s['tgt_MP'], s['sign'], s['max_acc'], s['max_dcc'], r)
+            _stopped = (_spd == 0) & (s['tgt'] == 0)
+            _acc2 = np.where(_stopped, 0.0, _acc2)
+            _acc2_int = _acc2_int | _stopped
+            _delta_s = _spd * r + 0.5 * _acc2 * r ** 2
+        return {t: (int(a) if a_int else a, int(v) if v_int else v, d)
+                for t, a, a_int, v, v_int, d in
+                zip(s['trains'], _acc2.tolist(), _acc2_int.tolist(),
+                    _spd.tolist(), _spd_int.tolist(), _delta_s.tolist())}
+
+    @staticmethod
+    def abs_brake_distance(spd, tgt_spd, dcc):
+        return np.where(dcc == 0, 0.0,
+                        np.where(np.abs(tgt_spd) < np.abs(spd),
+                                 np.abs(tgt_spd ** 2 - spd ** 2) /
+                                 (2 * np.abs(dcc)), 0.0))
+
+    def hold_speed_before_dcc(self, MP, tgt_MP, spd, tgt_spd, dcc, r):
+        _ds = spd * r
+        return ~((tgt_MP - MP) * (tgt_MP - (MP + _ds)) < 0) & \
+            (np.abs(tgt_MP - (MP + _ds)) >
+             self.abs_brake_distance(spd, tgt_spd, dcc)) & \
+            (np.abs(tgt_MP - MP) > np.abs(_ds))
+
+    def acc_before_dcc(self, MP, tgt_MP, spd, tgt_spd, sign, max_acc, dcc, r):
+        _ds = spd * r + 0.5 * (sign * max_acc) * r ** 2
+        _dspd = (sign * max_acc) * r
+        return self.hold_speed_before_dcc(MP, tgt_MP, spd, tgt_spd, dcc, r) & \
+            ~((tgt_MP - MP) * (tgt_MP - (MP + _ds)) < 0) & \
+            (np.abs(tgt_MP - (MP + _ds)) >
+             self.abs_brake_distance(spd + _dspd, tgt_spd, dcc)) & \
+            (np.abs(tgt_MP - MP) > np.abs(_ds))
+
+    def decide(self, MP, spd, acc, acc_int, lmt, tgt, tgt_MP, sign, max_acc,
+               max_dcc, r):
+        '''
+            Vectorized Train.curr_acc of running trains.
+            @return: (accelerations, mask of int zeros)'''
+        _acc_up = max_acc * sign
+        _brake = max_dcc * (-1) * sign
+        _zero = np.zeros_like(acc)
+        _hold = self.hold_speed_before_dcc(MP, tgt_MP, spd, tgt, max_dcc, r)
+        _delta_s = spd * r + 0.5 * acc * r ** 2
+        _at_lmt = np.abs(spd) == lmt
+        _below = np.abs(spd) < lmt
+        _acc_at_lmt = np.where(tgt >= lmt, _zero,
+                               np.where(_hold, _zero, _brake))
+        _no_cross = (tgt_MP - MP) * (tgt_MP - (MP + _delta_s)) >= 0
+        _acc_not_crossing = np.where(
+            (tgt >= lmt) | (tgt > np.abs(spd)), _acc_up,
+            np.where(self.acc_before_dcc(MP, tgt_MP, spd, tgt, sign, max_acc,
+                                         max_dcc, r), _acc_up,
+                     np.where(_hold, _zero, _brake)))
+        _acc_crossing = np.where((tgt >= lmt) | (tgt > np.abs(spd)),
+                                 _acc_up, _brake)
+        _acc = np.where(_at_lmt, _acc_at_lmt,
+                        np.where(_below,
+                                 np.where(_no_cross, _acc_not_crossing,
+                                          _acc_crossing),
+                                 acc))
+        # zeros are set by int literals; otherwise the acceleration is kept
+        return _acc, np.where(_at_lmt | _below, _acc == 0, acc_int)
+
+    @staticmethod
+    def new_speed(old, new, new_int, lmt, tgt):
+        '''
+            Vectorized Train.curr_speed setter.
+            @return: (speeds, mask of int values)'''
+        _sign = np.where(old >= 0, 1.0, -1.0)
+        _faster = np.where((lmt - np.abs(new)) * (lmt - np.abs(old)) < 0,
+                           _sign * lmt, new)
+        _slower = np.where((tgt - np.abs(new)) * (tgt - np.abs(old)) < 0,
+                           _sign * tgt, new)
+        _spd = np.where(new * old < 0, 0.0,
+                        np.where(np.abs(new) > np.abs(old), _faster,
+                                 np.where(np.abs(new) < np.abs(old), _slower,
+                                          new)))
+        return _spd, (new * old < 0) | (new_int & (_spd == new))
+
+    def commit(self, t, result):
+        '''
+            Write the result of a train back if neither its head nor its rear
+            crosses a SignalPoint, as Train.update_acc would.
+            @return: True if written, False to leave it to the object model.'''
+        (_acc, _spd, _delta_s) = result
+        _MP = t._curr_MP
+        _new_MP = _MP + _delta_s
+        if t.curr_sigpoint:
+            if not t.curr_track:
+                return False
+            if not min(t.curr_track.MP) < _new_MP < max(t.curr_track.MP):
+                return False
+        _delta_s = _new_MP - _MP
+        # delta as back-calculated by the curr_MP setter
+        _rear_MP = t._rear_curr_MP
+        _new_rear_MP = _rear_MP + _delta_s
+        if t.length:
+            if not t.rear_curr_sigpoint:
+                return False
+            if t.rear_curr_track:
+                if not min(t.rear_curr_track.MP) < _new_rear_MP < \
+                        max(t.rear_curr_track.MP):
+                    return False
+            elif (_new_rear_MP - t.rear_curr_sig.MP) * \
+                    (_rear_MP - t.rear_curr_sig.MP) < 0:
+                return False
+        t._curr_acc = _acc
+        t._curr_speed = _spd
+        t._curr_MP = _MP + _delta_s
+        t._rear_curr_MP = _rear_MP + (_new_rear_MP - _rear_MP) \
+            if t.length else t._curr_MP
+        t.rear_time_pos_list.append([self.system.sys_time, t._rear_curr_MP])
+        t.time_pos_list.append([self.system.sys_time, t._curr_MP])
+        self.system.trains.moved(t)
+        t.pos_spd_list.append([t._curr_MP, t._curr_speed, t.curr_spd_lmt_abs,
+                               t.curr_target_spd_abs])
+        return True
@@ -0,0 +1,357 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+    PyRailSim
+    Copyright (C) 2019  Zezhou Wang
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import hashlib
+import io
+import json
+import os
+import pickle
+import types
+
+from infrastructure import Track, Yard
+from signaling import AutoPoint, CtrlPoint
+
+TEST_NETWORK = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'test_network.json')
+COMPILED_FORMAT = 9
+# bump when the classes of the network change: invalidates compiled networks
+_compiled_networks = {}
+# pickled (G_origin, G_skeleton) by spec_hash, compiled in this process
+
+
+def load_spec(spec):
+    '''
+        A network spec is a dict (or the path of a JSON file of it):
+        {"nodes": [{"idx": int, "type": "cp", "ports": [int, ...],
+                    "ban_ports_by_port": {"port": [int, ...]}, "MP": float},
+                   {"idx": int, "type": "at", "MP": float}, ...],
+         "tracks": [{"L_point": idx, "L_point_port": int,
+                     "R_point": idx, "R_point_port": int,
+                     "edge_key": int, "allow_sp": mph, "yard": yard_id,
+                     "mainline": bool}, ...]}
+        Nodes are indexed 0 to n-1. edge_key, allow_sp, yard and mainline of
+        tracks are optional; tracks of the same yard_id share a Yard.
+        @return: dict'''
+    if isinstance(spec, dict):
+        return spec
+    with open(spec) as f:
+        return json.load(f)
+
+
+def spec_hash(spec):
+    '''
+        Content hash of a network spec (independent of the key order).'''
+    return hashlib.sha256(json.dumps(
+        [COMPILED_FORMAT, spec], sort_keys=True).encode()).hexdigest()
+
+
+def build_network(system, spec):
+    '''
+        Build the nodes and tracks of a network spec for
+        System.graph_constructor.
+        @return: (dict of nodes by idx, list of Tracks)'''
+    node = {}
+    for n in spec['nodes']:
+        if n['type'] == 'cp':
+            _kwargs = {} if 'ban_ports_by_port' not in n else {
+                'ban_ports_by_port': {int(p): banned for p, banned
+                                      in n['ban_ports_by_port'].items()}}
+            # JSON keys are str
+            node[n['idx']] = CtrlPoint(system, idx=n['idx'], ports=n['ports'],
+                                       MP=n['MP'], **_kwargs)
+        elif n['type'] == 'at':
+            node[n['idx']] = AutoPoint(system, idx=n['idx'], MP=n['MP'])
+        else:
+            raise ValueError('unknown type {} of node {}'
+                             .format(n['type'], n['idx']))
+    if sorted(node) != list(range(len(node))):
+        raise ValueError('nodes must be indexed from 0 to {}'
+                         .format(len(node) - 1))
+
+    yards, track, _connected = {}, [], set()
+    for t in spec['tracks']:
+        for (p, port) in ((t['L_point'], t['L_point_port']),
+                          (t['R_point'], t['R_point_port'])):
+            if port not in node[p].ports or (p, port) in _connected:
+                raise ValueError('port {} of node {} is not available'
+                                 .format(port, p))
+            _connected.add((p, port))
+        if t.get('yard') is not None and t['yard'] not in yards:
+            yards[t['yard']] = Yard(system)
+        track.append(Track(system, node[t['L_point']], t['L_point_port'],
+                           node[t['R_point']], t['R_point_port'],
+                           edge_key=t.get('edge_key', 0),
+                           allow_sp=t.get('allow_sp', 65),
+                           yard=yards.get(t.get('yard')),
+                           mainline=t.get('mainline')))
+    return node, track
+
+
+def _plain_instance(obj):
+    '''
+        True if obj is pickled as its class and its __dict__ only.'''
+    _cls = type(obj)
+    return isinstance(getattr(obj, '__dict__', None), dict) and \
+        not isinstance(obj, (type, types.FunctionType, types.ModuleType)) and \
+        _cls.__reduce_ex__ is object.__reduce_ex__ and \
+        _cls.__reduce__ is object.__reduce__ and \
+        getattr(_cls, '__getstate__', None) is \
+        getattr(object, '__getstate__', None) and \
+        not hasattr(_cls, '__setstate__')
+
+
+def _network_objects(root, system):
+    '''
+        All plain instances reachable from root (SignalPoints, Signals, Tracks,
+        BigBlocks, Yards, the graphs...), except the System.
+        @return: list'''
+    _objects, _seen, _stack = [], {id(system)}, [root]
+    while _stack:
+        obj = _stack.pop()
+        if id(obj) in _seen:
+            continue
+        _seen.add(id(obj))
+        if isinstance(obj, dict):
+            _stack.extend(obj.keys())
+            _stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            _stack.extend(obj)
+        elif _plain_instance(obj):
+            _objects.append(obj)
+            _stack.append(obj.__dict__)
+    return _objects
+
+
+class _NetworkPickler(pickle.Pickler):
+    """
+        Pickles a compiled network without its System. Instances of the
+        network are pickled by reference to their index in objects, so that
+        pickling does not recurse along the chains of SignalPoints and
+        Tracks of large networks."""
+
+    def __init__(self, file, system, objects):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.system = system
+        self.index = {id(obj): i for i, obj in enumerate(objects)}
+
+    def persistent_id(self, obj):
+        if obj is self.system:
+            return 'system'
+        return ('obj', self.index[id(obj)]) if id(obj) in self.index else None
+
+
+class _NetworkUnpickler(pickle.Unpickler):
+    """
+        Unpickles a compiled network into another System."""
+
+    def __init__(self, file, system, objects):
+        super().__init__(file)
+        self.system = system
+        self.objects = objects
+
+    def persistent_load(self, pid):
+        if pid == 'system':
+            return self.system
+        if isinstance(pid, tuple) and pid[0] == 'obj':
+            return self.objects[pid[1]]
+        raise pickle.UnpicklingError('unknown persistent id {}'.format(pid))
+
+
+def dump_network(G, F, system):
+    '''
+        Pickle the graphs of a System: the classes of their instances first,
+        then the states (__dict__) of the instances.
+        @return: bytes'''
+    _objects = _network_objects((G, F), system)
+    _buffer = io.BytesIO()
+    pickle.dump([type(obj) for obj in _objects], _buffer,
+                protocol=pickle.HIGHEST_PROTOCOL)
+    _NetworkPickler(_buffer, system, _objects).dump(
+        ([obj.__dict__ for obj in _objects], G, F))
+    return _buffer.getvalue()
+
+
+def load_network(data, system):
+    '''
+        Unpickle graphs pickled by dump_network for a System.
+        @return: (G_origin, G_skeleton)'''
+    _buffer = io.BytesIO(data)
+    _objects = [cls.__new__(cls) for cls in pickle.load(_buffer)]
+    _states, G, F = _NetworkUnpickler(_buffer, system, _objects).load()
+    for obj, state in zip(_objects, _states):
+        obj.__dict__ = state
+        # the same dict is the 'attr' of the node/edge in the graphs
+    return G, F
+
+
+def compile_network(system, spec, cache_dir=None):
+    '''
+        G_origin and G_skeleton of a System from a network spec.
+        The graphs are built by graph_constructor and graph_extractor once per
+        spec content, then pickled; later Systems of the process (and of any
+        process sharing cache_dir, e.g. pool workers) unpickle their own copy
+        instead of building it.
+        ----------
+        :cache_dir: directory of the compiled networks, named by spec_hash.
+            Kept in memory only if None.
+        @return: (G_origin, G_skeleton)'''
+    spec = load_spec(spec)
+    _key = spec_hash(spec)
+    _path = os.path.join(cache_dir, _key + '.pickle') if cache_dir else None
+    _data = _compiled_networks.get(_key)
+    if _data is None and _path and os.path.exists(_path):
+        with open(_path, 'rb') as f:
+            _data = f.read()
+    if _data is not None:
+        G, F = load_network(_data, system)
+        system.build_track_index(G)
+        _compiled_networks[_key] = _data
+        return G, F
+
+    G = system.graph_constructor(*build_network(system, spec))
+    F = system.graph_extractor(G)
+    _compiled_networks[_key] = dump_network(G, F, system)
+    if _path:
+        os.makedirs(cache_dir, exist_ok=True)
+        _tmp_path = '{}.{}.tmp'.format(_path, os.getpid())
+        with open(_tmp_path, 'wb') as f:
+            f.write(_compiled_networks[_key])
+        os.replace(_tmp_path, _path)
+        # concurrent workers never read a partial file
+    return G, F
+
+
+END_POINT = {'type': 'cp', 'ports': [0, 1],
+             'ban_ports_by_port': {'0': [0], '1': [1]}}
+# CtrlPoint at an end of a line, where trains initiate/terminate
+DIVERGING_SWITCH = {'type': 'cp', 'ports': [0, 1, 3],
+                    'ban_ports_by_port': {'1': [1, 3], '3': [3, 1]}}
+# CtrlPoint splitting port 0 (lower MP) into ports 1 and 3 (higher MP)
+CONVERGING_SWITCH = {'type': 'cp', 'ports': [0, 2, 1],
+                     'ban_ports_by_port': {'0': [0, 2], '2': [2, 0]}}
+# CtrlPoint merging ports 0 and 2 (lower MP) into port 1 (higher MP)
+LINE_POINT = END_POINT
+# CtrlPoint along a line, ending the BigBlocks on both sides
+
+
+def generate_network(num_blocks, siding_spacing=None, siding_length=1,
+                     branch_count=0, branch_blocks=4, block_length=5.0,
+                     ctrl_point_spacing=2):
+    '''
+        Generate the spec of a single-track main line with sidings and branch
+        lines, from the building blocks of the test network:
+            sidings: a DIVERGING_SWITCH and a CONVERGING_SWITCH joined by the
+                main line and by a parallel track (siding_length of 1, as
+                CtrlPoints 3-4), or by a loop of AutoPoints (siding_length
+                blocks, as CtrlPoints 5-8 through AutoPoints 11-12);
+            branches: a DIVERGING_SWITCH on the main line whose port 3 leads
+                to a line of branch_blocks blocks ending at an END_POINT, as
+                CtrlPoint 2 to CtrlPoint 13.
+        Along the main line and branches, a LINE_POINT replaces the AutoPoint
+        every ctrl_point_spacing blocks, so BigBlocks are as short as the ones
+        of the test network. A CtrlPoint cannot close the route of a train
+        leaving its BigBlock while a following train still runs towards it at
+        a proceeding aspect; over 2 blocks or less, the following train faces
+        the stop aspect of the leading one.
+        The main line is nodes 0 (MP 0.0) to num_blocks; loops and branches
+        are indexed after it. Branches are spread evenly over the main line
+        where no siding is.
+        ----------
+        :num_blocks: int, number of blocks (Tracks) of the main line, >= 2.
+        :siding_spacing: int, blocks between the starts of two sidings. No
+            sidings if None.
+        :siding_length: int, blocks of a siding.
+        :branch_count: int, number of branch lines.
+        :branch_blocks: int, number of blocks of a branch line.
+        :block_length: miles of a block. Trains must not run through more
+            than a block per refreshing cycle: keep the 5.0 of the test
+            network for refresh times of tens of seconds.
+        :ctrl_point_spacing: int, maximum blocks between two CtrlPoints
+            along a line, 1 or 2.
+        @return: dict (see load_spec)'''
+    if num_blocks < 2:
+        raise ValueError('at least 2 blocks are required')
+    if ctrl_point_spacing not in (1, 2):
+        raise ValueError('CtrlPoints must be spaced by 1 or 2 blocks')
+    if siding_spacing is not None and siding_spacing <= siding_length:
+        raise ValueError('sidings of {} blocks overlap when spaced by {}'
+                         .format(siding_length, siding_spacing))
+    _sidings = [] if siding_spacing is None else list(
+        range(siding_spacing, num_blocks - siding_length, siding_spacing))
+    # main line positions of the diverging switches of sidings
+    _occupied = set()
+    for p in _sidings:
+        _occupied.update(range(p, p + siding_length + 1))
+    _free = [p for p in range(1, num_blocks) if p not in _occupied]
+    if branch_count > len(_free):
+        raise ValueError('no room for {} branches'.format(branch_count))
+    _junctions = set(
+        _free[(2 * i + 1) * len(_free) // (2 * branch_count)]
+        for i in range(branch_count))
+
+    nodes, tracks = [], []
+
+    def _add_node(building_block, MP):
+        nodes.append(dict(building_block, idx=len(nodes), MP=MP))
+        return len(nodes) - 1
+
+    def _add_track(L_point, L_port, R_point, R_port, **kwargs):
+        tracks.append(dict(kwargs, L_point=L_point, L_point_port=L_port,
+                           R_point=R_point, R_point_port=R_port))
+
+    _siding_starts = set(_sidings)
+    _siding_ends = {p + siding_length for p in _sidings}
+    for p in range(num_blocks + 1):
+        _MP = p * block_length
+        if p in (0, num_blocks):
+            _add_node(END_POINT, _MP)
+        elif p in _siding_starts or p in _junctions:
+            _add_node(DIVERGING_SWITCH, _MP)
+        elif p in _siding_ends:
+            _add_node(CONVERGING_SWITCH, _MP)
+        elif p % ctrl_point_spacing == 0:
+            _add_node(LINE_POINT, _MP)
+        else:
+            _add_node({'type': 'at'}, _MP)
+    for p in range(num_blocks):
+        _yard = p if p in _siding_starts and siding_length == 1 else None
+        _add_track(p, 1, p + 1, 0, mainline=True,
+                   **({} if _yard is None else {'edge_key': 0, 'yard': _yard}))
+
+    for p in _sidings:
+        if siding_length == 1:
+            _add_track(p, 3, p + 1, 2, edge_key=1, yard=p)
+            continue
+        _prev = (p, 3)
+        for k in range(1, siding_length):
+            _loop_point = _add_node({'type': 'at'}, (p + k) * block_length)
+            _add_track(_prev[0], _prev[1], _loop_point, 0, yard=p)
+            _prev = (_loop_point, 1)
+        _add_track(_prev[0], _prev[1], p + siding_length, 2, yard=p)
+
+    for p in sorted(_junctions):
+        _prev = (p, 3)
+        for k in range(1, branch_blocks + 1):
+            _branch_point = _add_node(
+                END_POINT if k == branch_blocks else LINE_POINT
+                if k % ctrl_point_spacing == 0 else {'type': 'at'},
+                (p + k) * block_length)
+            _add_track(_prev[0], _prev[1], _branch_point, 0, mainline=True)
+            _prev = (_branch_point, 1)
+    return {'nodes': nodes, 'tracks': tracks}
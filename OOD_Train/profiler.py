@@ -0,0 +1,217 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+    PyRailSim
+    Copyright (C) 2019  Zezhou Wang
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import json
+import sys
+import time
+from functools import wraps
+
+import rail_networkx
+from kinematics import KinematicsCore
+from signaling import Signal
+from train import Train
+
+
+class TickProfiler():
+    """
+        Instrumentation of the refreshing cycles (ticks) of a System.
+        Off by default: enabled by System(..., profile=True), or with a file
+        path as profile=... to dump the report as JSON at the end of launch.
+
+        While enabled, the phases and hot paths below are wrapped at class
+        level (all Systems of the process are measured); nothing is wrapped
+        when disabled. Recorded:
+            per tick: wall time, and wall time of each phase;
+            per hot path: number of calls and cumulative time (outermost calls
+                only for recursive ones);
+            number of paths enumerated by rail_networkx.rail_simple_paths, i.e.
+                not served by the path caches of the graphs."""
+
+    PHASES = [(Train, 'request_routing'), (Train, 'update_acc'),
+              (KinematicsCore, 'update'), (None, 'generate_train')]
+    # top-level steps of a tick. None: the class of the System
+    HOT_PATHS = [(None, 'curr_routing_paths'), (None, 'capacity_enterable'),
+                 (None, 'get_trains_between_points'),
+                 (None, 'get_track_by_point_port_pairs'),
+                 (Signal, 'aspect'), (Train, 'curr_target_spd_abs'),
+                 (Train, 'stopped')]
+    PATH_FUNCTIONS = ['all_simple_paths', 'rail_simple_paths', 'shortest_path']
+    # path generators (*simple_paths) are timed per path enumerated
+
+    def __init__(self, system, dump_path=None):
+        self.system = system
+        self.dump_path = dump_path
+        self.ticks = []
+        self.calls = {}
+        self.paths_enumerated = 0
+        self._phase_times = {}
+        self._depth = {}
+        self._active_phase = None
+        self._tick_start = None
+        self._patched = []
+
+    def _name(self, cls, attr):
+        return '{}.{}'.format((cls or type(self.system)).__name__, attr)
+
+    def _timed(self, name, func, phase=False):
+        '''
+            Wrap a function to count its calls and time its outermost calls.'''
+        _profiler = self
+
+        @wraps(func)
+        def timed(*args, **kwargs):
+            _stat = _profiler.calls.setdefault(name, {'calls': 0, 'time': 0.0})
+            _stat['calls'] += 1
+            if _profiler._depth.get(name):
+                return func(*args, **kwargs)
+            _profiler._depth[name] = 1
+            _top_phase = phase and _profiler._active_phase is None
+            if _top_phase:
+                _profiler._active_phase = name
+            _start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _elapsed = time.perf_counter() - _start
+                _profiler._depth[name] = 0
+                _stat['time'] += _elapsed
+                if _top_phase:
+                    # phases nested in another phase are counted in the outer
+                    _profiler._active_phase = None
+                    _profiler._phase_times[name] = \
+                        _profiler._phase_times.get(name, 0.0) + _elapsed
+        return timed
+
+    def _counted_paths(self, name, func, enumerating=False):
+        '''
+            Wrap a path generator to count its calls and paths, timing the
+            enumeration of each path (not the time spent by the caller).
+            :enumerating: the paths are counted in paths_enumerated.'''
+        _profiler = self
+
+        @wraps(func)
+        def counted(*args, **kwargs):
+            _stat = _profiler.calls.setdefault(name, {'calls': 0, 'time': 0.0})
+            _stat['calls'] += 1
+            _paths = func(*args, **kwargs)
+            while True:
+                _start = time.perf_counter()
+                try:
+                    path = next(_paths)
+                except StopIteration:
+                    return
+                finally:
+                    _stat['time'] += time.perf_counter() - _start
+                if enumerating:
+                    _profiler.paths_enumerated += 1
+                yield path
+        return counted
+
+    def _patch(self, owner, attr, new):
+        self._patched.append((owner, attr, owner.__dict__[attr]
+                              if isinstance(owner, type)
+                              else getattr(owner, attr)))
+        setattr(owner, attr, new)
+
+    def instrument(self):
+        '''
+            Wrap the phases, hot paths and path enumeration.
+            @return: None'''
+        for (cls, attr), phase in [(p, True) for p in self.PHASES] + \
+                [(h, False) for h in self.HOT_PATHS]:
+            cls = cls or type(self.system)
+            _name = self._name(cls, attr)
+            _orig = cls.__dict__[attr]
+            if isinstance(_orig, property):
+                self._patch(cls, attr, property(
+                    self._timed(_name, _orig.fget, phase), _orig.fset,
+                    _orig.fdel, _orig.__doc__))
+            else:
+                self._patch(cls, attr, self._timed(_name, _orig, phase))
+        for fname in self.PATH_FUNCTIONS:
+            _orig = getattr(rail_networkx, fname)
+            _new = self._timed('rail_networkx.' + fname, _orig) \
+                if not fname.endswith('simple_paths') else \
+                self._counted_paths('rail_networkx.' + fname, _orig,
+                                    enumerating=fname == 'rail_simple_paths')
+            # replace the function in every module that imported it
+            for module in list(sys.modules.values()):
+                if getattr(module, fname, None) is _orig:
+                    self._patch(module, fname, _new)
+
+    def uninstrument(self):
+        '''
+            Restore everything wrapped by instrument().
+            @return: None'''
+        while self._patched:
+            (owner, attr, orig) = self._patched.pop()
+            setattr(owner, attr, orig)
+
+    def tick_start(self):
+        self._phase_times = {}
+        self._tick_start = time.perf_counter()
+
+    def tick_end(self, event=None):
+        self.ticks.append({'event': getattr(event, 'name', None),
+                           'sys_time': getattr(event, 'time', None),
+                           'wall_time': time.perf_counter() - self._tick_start,
+                           'phases': self._phase_times})
+
+    def report(self):
+        '''
+            Structured report of the recorded ticks.
+            @return: dict'''
+        _wall = [t['wall_time'] for t in self.ticks]
+        _phases = {}
+        for t in self.ticks:
+            for name, elapsed in t['phases'].items():
+                _phases[name] = _phases.get(name, 0.0) + elapsed
+        return {'ticks': len(self.ticks),
+                'tick_wall_time': {'total': sum(_wall),
+                                   'mean': sum(_wall) / len(_wall)
+                                   if _wall else 0.0,
+                                   'max': max(_wall) if _wall else 0.0},
+                'phases': _phases,
+                'calls': self.calls,
+                'paths_enumerated': self.paths_enumerated,
+                'per_tick': self.ticks}
+
+    def __str__(self):
+        _report = self.report()
+        _lines = ['{} ticks, {:.3f}s in total, {:.2f}ms per tick (max {:.2f}ms)'
+                  .format(_report['ticks'],
+                          _report['tick_wall_time']['total'],
+                          _report['tick_wall_time']['mean'] * 1000,
+                          _report['tick_wall_time']['max'] * 1000)]
+        for name, elapsed in sorted(_report['phases'].items(),
+                                    key=lambda i: -i[1]):
+            _lines.append('\tphase {:<40}{:>10.3f}s'.format(name, elapsed))
+        for name, stat in sorted(_report['calls'].items(),
+                                 key=lambda i: -i[1]['time']):
+            _lines.append('\t{:<46}{:>10.3f}s{:>10} calls'
+                          .format(name, stat['time'], stat['calls']))
+        _lines.append('\tpaths enumerated: {}'.format(self.paths_enumerated))
+        return '\n'.join(_lines)
+
+    def dump(self, path=None):
+        '''
+            Write the report as JSON to path (dump_path by default).
+            @return: None'''
+        with open(path or self.dump_path, 'w') as f:
+            json.dump(self.report(), f, indent=1)
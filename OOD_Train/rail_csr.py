@@ -0,0 +1,189 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+    PyRailSim
+    Copyright (C) 2019  Zezhou Wang
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy as np
+
+
+class CSRGraph():
+    """
+        Integer-indexed compilation of a (Multi)Graph of SignalPoints, e.g.
+        G_origin or G_skeleton, for the graph queries of the simulation.
+        Built from the networkx graph once its construction is done.
+
+        Ids:
+            nodes[i]: SignalPoint of node id i, in the node order of the graph.
+        CSR arrays (row i spans indptr[i]:indptr[i + 1]):
+            adjacency: indptr, indices (neighbor node ids). Parallel edges are
+                separate entries, in the order of G.edges(node) as networkx
+                iterates them.
+        Served to the traversals as Python rows (faster than indexing NumPy
+        arrays element by element): the neighbors of each node, the number
+        of parallel edges to each neighbor, and the banned_transitions of
+        each node as pairs of node ids (-1 for the outside of the network)."""
+
+    def __init__(self, G):
+        self.topology_version = getattr(G, 'topology_version', None)
+        self.nodes = list(G.nodes())
+        self.node_id = {n: i for i, n in enumerate(self.nodes)}
+        _n = len(self.nodes)
+
+        _indptr, _indices = [0], []
+        for u in self.nodes:
+            for v, edges in G.adj[u].items():
+                _indices.extend([self.node_id[v]] *
+                                (len(edges) if G.is_multigraph() else 1))
+            _indptr.append(len(_indices))
+        self.indptr = np.array(_indptr, dtype=np.int64)
+        self.indices = np.array(_indices, dtype=np.int64)
+
+        self._adjacency = [self.indices[self.indptr[i]:self.indptr[i + 1]]
+                           .tolist() for i in range(_n)]
+        self._multiplicity = [{} for _ in range(_n)]
+        for i, row in enumerate(self._adjacency):
+            for j in row:
+                self._multiplicity[i][j] = self._multiplicity[i].get(j, 0) + 1
+        self._banned = [{(self.node_id.get(p1, -1), self.node_id.get(p3, -1))
+                         for (p1, p3) in getattr(n, 'banned_transitions', ())}
+                        for n in self.nodes]
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def number_of_edges(self, i, j):
+        '''
+            Number of parallel edges between node ids i and j (0 if either is
+            not a node id).'''
+        return self._multiplicity[i].get(j, 0) if 0 <= i < len(self.nodes) \
+            else 0
+
+    def has_path_without(self, source, target, removed):
+        '''
+            Whether node id target is reachable from node id source, where
+            removed[(i, j)] (i <= j) of the parallel edges between node ids i
+            and j are taken out.'''
+        _multiplicity = self._multiplicity
+        _visited, _stack = {source}, [source]
+        while _stack:
+            i = _stack.pop()
+            if i == target:
+                return True
+            for j, _edges in _multiplicity[i].items():
+                if j not in _visited and \
+                        _edges > removed.get((min(i, j), max(i, j)), 0):
+                    _visited.add(j)
+                    _stack.append(j)
+        return False
+
+    def simple_paths(self, source, target, cutoff=None):
+        '''
+            Generate the simple paths (lists of node ids) from node id source
+            to node id target without banned transitions, in the order of
+            rail_networkx.rail_simple_paths.'''
+        cutoff = len(self.nodes) - 1 if cutoff is None else cutoff
+        if source == target or cutoff < 1:
+            return
+        _adjacency, _banned = self._adjacency, self._banned
+        visited = bytearray(len(self.nodes))
+        visited[source] = 1
+        path = [source]
+        stack = [iter(_adjacency[source])]
+        while stack:
+            child = next(stack[-1], None)
+            if child is None:
+                stack.pop()
+                visited[path.pop()] = 0
+            elif len(path) < cutoff:
+                if visited[child]:
+                    continue
+                if len(path) > 1 and (path[-2], child) in _banned[path[-1]]:
+                    continue
+                if child == target:
+                    yield path + [child]
+                else:
+                    path.append(child)
+                    visited[child] = 1
+                    stack.append(iter(_adjacency[child]))
+            else:
+                # one node left to visit: the target, through any parallel
+                # edges
+                if not visited[target] and (len(path) < 2 or (
+                        path[-2], target) not in _banned[path[-1]]):
+                    for _ in range(([child] + list(stack[-1])).count(target)):
+                        yield path + [target]
+                stack.pop()
+                visited[path.pop()] = 0
+
+    def reach_by_state(self):
+        '''
+            Reachability of every state (p, u), i.e. node id u entered from its
+            neighbor node id p, by walks without banned transitions nor
+            immediate reversals: the nodes of these walks (u included) as a
+            bitset, bit i for node id i. States of a loop share their bitset.
+            Computed over the strongly connected components of the states, in
+            time linear in the states and their bitset operations.
+            @return: dict {(p, u): int}'''
+        _adjacency, _banned = self._adjacency, self._banned
+        _successors = {}
+        for u in range(len(self.nodes)):
+            for p in set(_adjacency[u]):
+                _successors[(p, u)] = [(u, v) for v in dict.fromkeys(
+                    _adjacency[u]) if v != p and (p, v) not in _banned[u]]
+        _reach, _index, _low, _on_stack, _scc_stack = {}, {}, {}, set(), []
+        for root in _successors:
+            if root in _index:
+                continue
+            _index[root] = _low[root] = len(_index)
+            _scc_stack.append(root)
+            _on_stack.add(root)
+            _work = [(root, iter(_successors[root]))]
+            # iterative Tarjan: successors are done before their states
+            while _work:
+                (state, _succ) = _work[-1]
+                child = next(_succ, None)
+                if child is not None:
+                    if child not in _index:
+                        _index[child] = _low[child] = len(_index)
+                        _scc_stack.append(child)
+                        _on_stack.add(child)
+                        _work.append((child, iter(_successors[child])))
+                    elif child in _on_stack:
+                        _low[state] = min(_low[state], _index[child])
+                    continue
+                _work.pop()
+                if _work:
+                    _low[_work[-1][0]] = min(_low[_work[-1][0]], _low[state])
+                if _low[state] != _index[state]:
+                    continue
+                _scc = []
+                while True:
+                    _member = _scc_stack.pop()
+                    _on_stack.discard(_member)
+                    _scc.append(_member)
+                    if _member == state:
+                        break
+                _bits = 0
+                for (_, u) in _scc:
+                    _bits |= 1 << u
+                for _member in _scc:
+                    for child in _successors[_member]:
+                        if child in _reach:
+                            _bits |= _reach[child]
+                for _member in _scc:
+                    _reach[_member] = _bits
+        return _reach
@@ -25,28 +25,328 @@ sys.path.append(
     'D:\\Users\\Hegxiten\\workspace\\Rutgers_Railway_security_research\\OOD_Train'
 )
 
+import heapq
+from collections import OrderedDict
 from functools import wraps
+from itertools import count
 
 import networkx as nx
 
+from rail_csr import CSRGraph
+
+
+def rail_simple_paths(G, source, target, cutoff=None):
+    '''
+        Generate the simple paths from source to target in the (Multi)Graph G
+        of SignalPoints, without the banned transitions of the points.
+        On a RailGraph, the search runs over its CSRGraph compilation.
+        Depth-first, in the same order as nx.all_simple_paths (a path is
+        generated once per combination of parallel edges), except that the
+        search never crosses a point p2 from p1 to p3 when (p1, p3) is in
+        p2.banned_transitions, instead of discarding the paths afterwards.
+        The banned transitions are those of the triples (p1, p2, p3) of
+        p2.banned_paths.'''
+    if source not in G:
+        raise nx.NodeNotFound('source node {} not in graph'.format(source))
+    if target not in G:
+        raise nx.NodeNotFound('target node {} not in graph'.format(target))
+    if source == target:
+        return
+    if isinstance(G, RailGraph):
+        _csr = G.csr
+        for path in _csr.simple_paths(_csr.node_id[source],
+                                      _csr.node_id[target], cutoff=cutoff):
+            yield [_csr.nodes[i] for i in path]
+        return
+    cutoff = len(G) - 1 if cutoff is None else cutoff
+    if cutoff < 1:
+        return
+    path, visited = [source], {source}
+    stack = [(v for u, v in G.edges(source))]
+    while stack:
+        children = stack[-1]
+        child = next(children, None)
+        if child is None:
+            stack.pop()
+            visited.remove(path.pop())
+        elif len(path) < cutoff:
+            if child in visited:
+                continue
+            if len(path) > 1 and \
+                    (path[-2], child) in path[-1].banned_transitions:
+                continue
+            if child == target:
+                yield path + [child]
+            else:
+                path.append(child)
+                visited.add(child)
+                stack.append((v for u, v in G.edges(child)))
+        else:
+            # one node left to visit: the target, through any parallel edges
+            if target not in visited and (len(path) < 2 or (
+                    path[-2], target) not in path[-1].banned_transitions):
+                for _ in range(([child] + list(children)).count(target)):
+                    yield path + [target]
+            stack.pop()
+            visited.remove(path.pop())
+
+
+def _edge_weight(G, weight):
+    '''
+        Weight function of the edges of G as nx.shortest_path: the minimum
+        among parallel edges, 1 for missing attributes or when weight is None.'''
+    if weight is None:
+        return lambda edges: 1
+    if G.is_multigraph():
+        return lambda edges: min(attr.get(weight, 1) for attr in edges.values())
+    return lambda edges: edges.get(weight, 1)
+
+
+def is_allowed_path(path):
+    '''
+        True if the path crosses no point through its banned transitions.'''
+    return all((p1, p3) not in p2.banned_transitions
+               for p1, p2, p3 in zip(path[0:], path[1:], path[2:]))
+
+
+def turn_restricted_dijkstra(G, source, target, weight=None):
+    '''
+        Shortest walk from source to target in G without banned transitions:
+        Dijkstra over the states (previous point, point), the banned
+        transitions of a point depending on the point it is entered from.
+        Immediate reversals (p1, p2, p1) are never taken.
+        @return: list of points, None if target is unreachable.'''
+    _weight = _edge_weight(G, weight)
+    _order = count()
+    _start = (None, source)
+    dist, prev, done = {_start: 0}, {_start: None}, set()
+    heap = [(0, next(_order), _start)]
+    while heap:
+        (d, _, state) = heapq.heappop(heap)
+        if state in done:
+            continue
+        done.add(state)
+        (p, u) = state
+        if u == target:
+            path = []
+            while state is not None:
+                path.append(state[1])
+                state = prev[state]
+            return path[::-1]
+        for v, edges in G.adj[u].items():
+            if v == p or (p is not None and (p, v) in u.banned_transitions):
+                continue
+            _dist = d + _weight(edges)
+            if (u, v) not in dist or _dist < dist[(u, v)]:
+                dist[(u, v)], prev[(u, v)] = _dist, state
+                heapq.heappush(heap, (_dist, next(_order), (u, v)))
+    return None
+
+
+def rail_shortest_path(G, source, target, weight=None, raw_shortest=None):
+    '''
+        Shortest path from source to target in G (by the weight attribute of
+        edges, by number of edges if None) without banned transitions.
+        The shortest path of networkx (raw_shortest, computed if None) is
+        kept if it is allowed. Otherwise the turn-restricted Dijkstra search
+        is used; if its shortest walk passes a point twice, the allowed
+        simple paths are compared instead.
+        @return: list of points'''
+    if raw_shortest is None:
+        raw_shortest = nx.shortest_path(G, source, target, weight=weight)
+    if len(raw_shortest) <= 2 or is_allowed_path(raw_shortest):
+        return raw_shortest
+    _path = turn_restricted_dijkstra(G, source, target, weight=weight)
+    if _path is not None and len(set(_path)) < len(_path):
+        _weight = _edge_weight(G, weight)
+        _path = min(rail_simple_paths(G, source, target), default=None,
+                    key=lambda path: sum(_weight(G.adj[u][v]) for u, v
+                                         in zip(path[0:], path[1:])))
+    if _path is None:
+        raise Exception("Cannot Find a shortest Path Between \
+                        {} and {}!".format(source, target))
+    return _path
+
+
+class LazyPaths():
+    """
+        Paths of a query, enumerated from the generator on demand only and
+        kept for the next iterations. Iterators share the enumeration."""
+
+    def __init__(self, paths):
+        self._paths = paths
+        self.enumerated = []
+
+    @property
+    def complete(self):
+        return self._paths is None
+
+    def __iter__(self):
+        i = 0
+        while True:
+            if i == len(self.enumerated):
+                if self._paths is None:
+                    return
+                path = next(self._paths, None)
+                if path is None:
+                    self._paths = None
+                    return
+                self.enumerated.append(path)
+            yield self.enumerated[i]
+            i += 1
+
+
+class PathCache():
+    """
+        Bounded cache of path queries with least-recently-used eviction.
+        Each RailGraph has its own, keyed by (topology_version, query, source,
+        target, cutoff or weight): results of a previous topology are never
+        returned, and are evicted as the least recently used.
+        Copies (deepcopy, pickle) of the cache are empty."""
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __reduce__(self):
+        return (self.__class__, (self.maxsize,))
+
+    def get(self, key, compute):
+        '''
+            The cached result of key, or the result of compute() cached.'''
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        self.misses += 1
+        _result = compute()
+        self._entries[key] = _result
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return _result
+
+    def clear(self):
+        self._entries.clear()
+
+
+class FrozenTopologyError(nx.NetworkXError):
+    """
+        Raised when the topology of a network is changed after
+        System.freeze()."""
+
+
+class RailGraph(nx.MultiGraph):
+    """
+        MultiGraph of SignalPoints (nodes) and Tracks or BigBlocks (edges).
+        topology_version is bumped by every addition or removal of nodes and
+        edges, invalidating the path queries cached in path_cache.
+        Call topology_changed() after editing attributes used by the path
+        queries (e.g. weight_mainline) of an existing edge.
+        Once frozen (see freeze), changing the topology raises
+        FrozenTopologyError."""
+
+    def __init__(self, incoming_graph_data=None, **attr):
+        self.frozen = False
+        self.topology_version = 0
+        self.path_cache = PathCache()
+        self._csr = None
+        super().__init__(incoming_graph_data, **attr)
+
+    @property
+    def csr(self):
+        '''
+            CSRGraph compilation of the graph, compiled again when the
+            topology changes. Compiled at the first query: the network must
+            be built (tracks and BigBlocks).'''
+        if self._csr is None or \
+                self._csr.topology_version != self.topology_version:
+            self._csr = CSRGraph(self)
+        return self._csr
+
+    def freeze(self):
+        '''
+            Forbid any further change of the topology.
+            @return: None'''
+        self.frozen = True
+
+    def topology_changed(self):
+        if self.frozen:
+            raise FrozenTopologyError(
+                'topology of a frozen RailGraph cannot be changed')
+        self.topology_version += 1
+
+    def cached_query(self, key, compute):
+        '''
+            Result of a path query on the current topology, computed by
+            compute() if not cached.'''
+        return self.path_cache.get((self.topology_version,) + key, compute)
+
+    def add_node(self, node_for_adding, **attr):
+        self.topology_changed()
+        super().add_node(node_for_adding, **attr)
+
+    def add_nodes_from(self, nodes_for_adding, **attr):
+        self.topology_changed()
+        super().add_nodes_from(nodes_for_adding, **attr)
+
+    def remove_node(self, n):
+        self.topology_changed()
+        super().remove_node(n)
+
+    def remove_nodes_from(self, nodes):
+        self.topology_changed()
+        super().remove_nodes_from(nodes)
+
+    def add_edge(self, u_for_edge, v_for_edge, key=None, **attr):
+        self.topology_changed()
+        return super().add_edge(u_for_edge, v_for_edge, key=key, **attr)
+
+    def add_edges_from(self, ebunch_to_add, **attr):
+        self.topology_changed()
+        return super().add_edges_from(ebunch_to_add, **attr)
+
+    def remove_edge(self, u, v, key=None):
+        self.topology_changed()
+        super().remove_edge(u, v, key=key)
+
+    def remove_edges_from(self, ebunch):
+        self.topology_changed()
+        super().remove_edges_from(ebunch)
+
+    def clear(self):
+        self.topology_changed()
+        super().clear()
+
+    def clear_edges(self):
+        self.topology_changed()
+        super().clear_edges()
+
 
 def no_banned_rail_paths_on_cp(func):
 
     if func.__name__ == 'all_simple_paths':
 
-        @wraps(func)
-        def filter_banned_paths_all(G, source, target, cutoff=None):
+        def simple_paths(G, source, target, cutoff):
             if source == target:
                 yield [source]
-            raw_simple_path_gen = func(G, source, target, cutoff=None)
-            for path in raw_simple_path_gen:
-                if len(path) <= 2:
-                    yield path
-                elif all([
-                        True if (p1, p2, p3) not in p2.banned_paths else False
-                        for p1, p2, p3 in zip(path[0:], path[1:], path[2:])
-                ]):
-                    yield path
+            yield from rail_simple_paths(G, source, target, cutoff=cutoff)
+
+        @wraps(func)
+        def filter_banned_paths_all(G, source, target, cutoff=None):
+            if not isinstance(G, RailGraph) or \
+                    source not in G or target not in G:
+                yield from simple_paths(G, source, target, cutoff)
+                return
+            for path in G.cached_query(
+                    ('all_simple_paths', source, target, cutoff),
+                    lambda: LazyPaths(simple_paths(G, source, target, cutoff))):
+                yield list(path)
+                # copies: callers may consume the paths
 
         return filter_banned_paths_all
 
@@ -54,25 +354,16 @@ def no_banned_rail_paths_on_cp(func):
 
         @wraps(func)
         def filter_banned_cp_path_shortest(G, source, target, weight=None):
-            raw_shortest = func(G, source, target, weight=weight)
-            while True:
-                if len(list(all_simple_paths(G, source, target))) == 1:
-                    return raw_shortest
-                elif len(raw_shortest) <= 2:
-                    return raw_shortest
-                elif all([
-                        True if (p1, p2, p3) not in p2.banned_paths else False 
-                        for p1, p2, p3 in zip(raw_shortest[0:], raw_shortest[1:],
-                                    raw_shortest[2:])
-                        ]):
-                    return raw_shortest
-                else:
-                    if raw_shortest != func(G, source, target):
-                        raw_shortest = func(G, source, target)
-                    else:
-                        raise Exception("Cannot Find a shortest Path Between \
-                                        {} and {}!".format(source, target))
-            
+            def _shortest():
+                return rail_shortest_path(
+                    G, source, target, weight=weight,
+                    raw_shortest=func(G, source, target, weight=weight))
+            if not isinstance(G, RailGraph):
+                return _shortest()
+            return list(G.cached_query(
+                ('shortest_path', source, target, weight), _shortest))
+            # a copy: callers consume the path
+
         return filter_banned_cp_path_shortest
 
 
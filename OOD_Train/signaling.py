@@ -25,7 +25,8 @@ import networkx as nx
 
 import infrastructure
 from observe import Observable, Observer
-from rail_networkx import all_simple_paths, shortest_path
+from rail_networkx import (FrozenTopologyError, all_simple_paths,
+                           shortest_path)
 
 
 class Aspect():
@@ -112,9 +113,17 @@ class Signal(Observable, Observer):
         self._MP = MP
         self.port_idx = port_idx
         self._aspect = Aspect('r', route=self.route)
+        self._aspect_version = None
+        # routing_version of the cached aspect. None: marked dirty
+        self._watched_tracks = []
+        # tracks ahead the cached aspect depends on, observed by the signal
+        self._frozen_facing_direction_sign = None
+        # kept by freeze
 
     @property
     def facing_direction_sign(self):
+        if self._frozen_facing_direction_sign is not None:
+            return self._frozen_facing_direction_sign
         if self.governed_track:
             if max(self.governed_track.MP) == self.MP:
                 return 1
@@ -126,6 +135,17 @@ class Signal(Observable, Observer):
             return -self.sigpoint.signal_by_port[self.sigpoint.opposite_port(
                 self.port_idx)].facing_direction_sign
 
+    def freeze(self):
+        '''
+            Keep the facing direction sign of the signal, if defined, see
+            System.freeze.
+            @return: None'''
+        try:
+            self._frozen_facing_direction_sign = self.facing_direction_sign
+        except (AssertionError, ValueError):
+            pass
+            # undefined: raised again by facing_direction_sign
+
     @property
     def upwards(self):
         return True if self.facing_direction_sign == -1 else False
@@ -146,6 +166,10 @@ class Signal(Observable, Observer):
 
     @MP.setter
     def MP(self, new_MP):
+        if self.system is not None and self.system.frozen:
+            raise FrozenTopologyError(
+                'MilePost of {} cannot be changed after System.freeze()'
+                .format(self))
         print('Warning:\n\tSetting MilePost manually for {}!\n\t\
             Changing from old MP {} to new MP {}'
             .format(self, self._MP, new_MP))
@@ -153,32 +177,64 @@ class Signal(Observable, Observer):
 
     @property
     def aspect(self):
-        # print('\tcall aspect of {} route {}'.format(self.sigpoint,self.route))
-        self._aspect.route = self.route
+        '''
+            Aspect of the signal, recomputed only after a change of routes or
+            routings (System.routing_version) or a notification of the tracks
+            ahead it depends on (see update).
+            With System.aspects (AspectCore), the aspect of the snapshot of
+            all signals instead.'''
+        if self.system.aspects is not None:
+            self._aspect.color, self._aspect.route = \
+                self.system.aspects.aspect_state(self)
+            return self._aspect
+        if self._aspect_version != self.system.routing_version:
+            # print('\tcall aspect of {} route {}'.format(self.sigpoint,self.route))
+            self._aspect.route = self.route
+            self._aspect.color = self.current_color()
+            self._aspect_version = self.system.routing_version
+        return self._aspect
+
+    def current_color(self):
+        '''
+            Compute the color of the aspect, and observe the tracks ahead it
+            depends on (up to the first occupied one) instead of the ones
+            observed for the previous color.'''
+        _watched_tracks, _number = [], 0
+        if self.route and not self.cleared_signal_to_exit_system:
+            for t in self.tracks_ahead:
+                if t:
+                    _watched_tracks.append(t)
+                    if t.is_Occupied:
+                        break
+                    _number += 1
+        for t in self._watched_tracks:
+            t.remove_observer(self)
+        for t in _watched_tracks:
+            t.add_observer(self)
+        self._watched_tracks = _watched_tracks
         if not self.route:
-            self._aspect.color = 'r'
+            return 'r'
         elif self.cleared_signal_to_exit_system:  # exiting the system
-            self._aspect.color = 'g'
-        elif self.number_of_blocks_cleared_ahead == 0:
-            self._aspect.color = 'r'
-        elif self.number_of_blocks_cleared_ahead == 1:
+            return 'g'
+        elif _number == 0:
+            return 'r'
+        elif _number == 1:
             if self.next_enroute_signal.cleared_signal_to_exit_system:
-                self._aspect.color = 'g'
+                return 'g'
             else:
-                self._aspect.color = 'y'
-        elif self.number_of_blocks_cleared_ahead == 2:
+                return 'y'
+        elif _number == 2:
             if self.next_enroute_signal.next_enroute_signal.\
                 cleared_signal_to_exit_system:
-                self._aspect.color = 'g'
+                return 'g'
             else:
-                self._aspect.color = 'yy'
-        elif self.number_of_blocks_cleared_ahead >= 3:
-            self._aspect.color = 'g'
+                return 'yy'
+        elif _number >= 3:
+            return 'g'
         else:
             raise ValueError(
                 'signal aspect of {}, port: {} not defined ready'.format(
                     self.sigpoint, self.port_idx))
-        return self._aspect
 
     @property
     def permit_track(self):
@@ -239,23 +295,29 @@ class Signal(Observable, Observer):
         else:
             return None
 
+    @property
+    def tracks_ahead(self):
+        '''
+            Tracks of the current routing path after the governed track (None
+            for the ends of the routing path without tracks).'''
+        _curr_enroute_tracks = self.curr_enroute_tracks
+        if not _curr_enroute_tracks:
+            return []
+        if self.governed_track:
+            _trk_idx = self.curr_routing_path.index(
+                self.governed_track.routing)
+        else:
+            _trk_idx = 0
+        return _curr_enroute_tracks[_trk_idx + 1:]
+
     @property
     def number_of_blocks_cleared_ahead(self):
         _number = 0
-        if self.curr_enroute_tracks:
-            if self.governed_track:
-                _trk_idx = self.curr_routing_path.index(
-                    self.governed_track.routing)
-            else:
-                _trk_idx = 0
-            _tracks_ahead = self.curr_enroute_tracks[_trk_idx + 1:]
-            for i in range(len(_tracks_ahead)):
-                if _tracks_ahead[i]:
-                    if _tracks_ahead[i].is_Occupied:
-                        return _number
-                    elif not _tracks_ahead[i].is_Occupied:
-                        _number += 1
-                        continue
+        for t in self.tracks_ahead:
+            if t:
+                if t.is_Occupied:
+                    return _number
+                _number += 1
         return _number
 
     @property
@@ -283,14 +345,15 @@ class Signal(Observable, Observer):
             HomeSignal")
 
     def reachable(self, other):
+        '''
+            Whether a SignalPoint, Signal, Track or BigBlock can be reached by
+            a route leaving this signal. Bit tests of the reachable points
+            built by System.build_reachability.'''
+        _points = self.system._reachable_points_by_signal.get(self, 0)
+        _bit = self.system._reachable_bit_by_point
+
         def reachable_sigpoint(p):
-            gen = all_simple_paths(self.system.G_origin, self.sigpoint, p)
-            while True:
-                try:
-                    if next(gen)[1] in self.following_sigpoints:
-                        return True
-                except: break
-            return False
+            return bool(_points & _bit.get(p, 0))
         def reachable_track(t):
             if self.sigpoint in (t.L_point, t.R_point):
                 if self.governed_track == t: return False
@@ -314,18 +377,13 @@ class Signal(Observable, Observer):
             return reachable_track(other)
         return False
 
-    #----------------deprecated----------------#
     def update(self, observable, update_message):
-        raise NotImplementedError("Old-version function to be refactored")
-        if observable.type == 'bigblock':
-            self.change_color_to('r', False)
-        elif observable.type == 'track':
-            self.change_color_to('r', False)
-        elif observable.type == 'home' and observable.port_idx != self.port_idx:
-            if update_message.color != 'r':
-                self.change_color_to('r', False)
-        else: pass
+        '''
+            Notified by an observed track ahead when its occupancy changes:
+            the aspect is marked dirty.'''
+        self._aspect_version = None
 
+    #----------------deprecated----------------#
     def change_color_to(self, color, isNotified=True):
         raise NotImplementedError("Old-version function to be refactored")
         self.aspect = new_aspect
@@ -400,6 +458,9 @@ class InterlockingPoint(Observable, Observer):
         self.neighbor_nodes = []
         self.track_by_port = {}
         self._curr_train_with_route = {}
+        self._banned_transitions = None
+        self._frozen_banned_paths = None
+        # kept by freeze
 
     @abstractproperty
     def all_valid_routes(self): pass
@@ -466,12 +527,34 @@ class InterlockingPoint(Observable, Observer):
         raise NotImplementedError("Needed to be implemented in AutoPoint or \
             CtrlPoint")
 
+    def freeze(self):
+        '''
+            Keep the static properties of the point and of its signals, see
+            System.freeze.
+            @return: None'''
+        self._frozen_banned_paths = self.banned_paths
+        for sig in self.signal_by_port.values():
+            sig.freeze()
+
+    @property
+    def banned_transitions(self):
+        '''
+            Set of (previous point, next point) of the banned_paths crossing
+            the point, for the path search of rail_networkx. Collected at the
+            first call: the network must be built (tracks and BigBlocks).'''
+        if self._banned_transitions is None:
+            self._banned_transitions = {
+                (p1, p3) for (p1, _, p3) in self.banned_paths}
+        return self._banned_transitions
+
 
 class AutoPoint(InterlockingPoint):
     def __init__(self, system, idx, MP=None):
         super().__init__(system, idx, MP)
         self.type = 'at'
         self.ports = [0, 1]
+        self._frozen_bigblock = None
+        # kept by freeze
         self.available_ports_by_port = {0: [1], 1: [0]}  # define legal routes
         self.non_mutex_routes_by_route = {}
         self.ban_ports_by_port = {0: [0], 1: [1]}
@@ -489,8 +572,14 @@ class AutoPoint(InterlockingPoint):
 
     @property
     def bigblock(self):
+        if self._frozen_bigblock is not None:
+            return self._frozen_bigblock
         return [t.bigblock for _,t in self.track_by_port.items()][0]
 
+    def freeze(self):
+        super().freeze()
+        self._frozen_bigblock = self.bigblock
+
     @property
     def all_valid_routes(self): return [(0, 1), (1, 0)]
 
@@ -534,12 +623,16 @@ class CtrlPoint(InterlockingPoint):
         self.non_mutex_routes_by_route = non_mutex_routes_by_route
         self._current_routes = []
         self.bigblock_by_port = {}
+        self._frozen_vertex = None
+        # kept by freeze
         # available options for routes, dict[port] = list(options)
         self.available_ports_by_port = defaultdict(list)
         for i in self.ports:
             for j in self.ports:
                 if j not in self.ban_ports_by_port.get(i, []):
                     self.available_ports_by_port[i].append(j)
+        self.compile_interlocking()
+        # route ids and conflict bitmasks of the routes
 
         self.signal_by_port = {}  # build up signals
         for i in self.ports:
@@ -556,13 +649,22 @@ class CtrlPoint(InterlockingPoint):
 
     @property
     def vertex(self):
+        if self._frozen_vertex is not None:
+            return self._frozen_vertex
         for i in self.ports:
             if not self.track_by_port.get(i):
                 return True
         return False
 
-    @property
-    def all_valid_routes(self):
+    def compile_interlocking(self):
+        '''
+            Compile the static interlocking tables: route ids (bit i of a
+            bitmask for route id i) of the valid and banned routes, and per
+            valid route, the bitmasks of its mutex routes and of the routes
+            conflicting with it while it is open.
+            Call again after editing ports, ban_ports_by_port or
+            non_mutex_routes_by_route.
+            @return: None'''
         # available options for routes, list of routes
         _all_valid_routes = []
         for p, plist in self.available_ports_by_port.items():
@@ -571,15 +673,97 @@ class CtrlPoint(InterlockingPoint):
                     _all_valid_routes.append((p, rp))
                 if (rp, p) not in _all_valid_routes:
                     _all_valid_routes.append((rp, p))
-        return _all_valid_routes
+        # all banned routes in a permutation list of 2-element tuples
+        _banned_routes = []
+        for p, bplist in self.ban_ports_by_port.items():
+            for bp in bplist:
+                if (p, bp) not in _banned_routes:
+                    _banned_routes.append((p, bp))
+                if (bp, p) not in _banned_routes:
+                    _banned_routes.append((bp, p))
+        self._all_valid_routes = _all_valid_routes
+        self.route_id = {}
+        for r in _all_valid_routes + _banned_routes:
+            self.route_id.setdefault(r, len(self.route_id))
+        self._route_by_id = list(self.route_id)
+        self._banned_routes_mask = self.routes_mask(_banned_routes)
+        self._ban_ports_mask = self.routes_mask(
+            (p, bp) for p, bplist in self.ban_ports_by_port.items()
+            for bp in bplist)
+        self._mutex_routes_by_route = defaultdict(list)
+        for vr in _all_valid_routes:
+            _mutex_routes = [r for r in _all_valid_routes]
+            _mutex_routes.remove(vr)
+            self._mutex_routes_by_route[vr].extend(_mutex_routes)
+        for r, nmrl in self.non_mutex_routes_by_route.items():
+            if nmrl in self._mutex_routes_by_route[r]:
+                self._mutex_routes_by_route[r].remove(nmrl)
+        self._mutex_mask_by_route = {
+            r: self.routes_mask(mrl)
+            for r, mrl in self._mutex_routes_by_route.items()}
+        self._conflict_mask_by_route = {
+            r: self.routes_mask(
+                vr for vr in _all_valid_routes
+                if vr not in self.non_mutex_routes_by_route.get(r, []))
+            for r in _all_valid_routes}
+
+    def routes_mask(self, routes):
+        '''
+            Bitmask of the routes, ignoring routes without a route id.'''
+        _mask = 0
+        for r in routes:
+            if r in self.route_id:
+                _mask |= 1 << self.route_id[r]
+        return _mask
+
+    @property
+    def all_valid_routes(self):
+        '''
+            List of valid routes, compiled by compile_interlocking.
+            Shared: do not modify.'''
+        return self._all_valid_routes
+
+    @property
+    def mutex_routes_by_route(self):
+        '''
+            Lists of mutex routes by valid route, compiled by
+            compile_interlocking. Shared: do not modify.'''
+        return self._mutex_routes_by_route
+
+    @property
+    def current_invalid_routes_mask(self):
+        '''
+            Bitmask of the routes that cannot be opened now: banned routes,
+            routes conflicting with the open routes, and routes locked by
+            trains.'''
+        _mask = self._banned_routes_mask
+        for r in self._current_routes:
+            _mask |= self._conflict_mask_by_route[r]
+        for r in self._curr_train_with_route.values():
+            _mask |= 1 << self.route_id[r] | self._mutex_mask_by_route[r]
+        return _mask
+
+    @property
+    def current_invalid_routes(self):
+        _mask = self.current_invalid_routes_mask
+        return [r for i, r in enumerate(self._route_by_id) if _mask >> i & 1]
+
+    def is_invalid_route(self, route):
+        '''
+            Whether the route is in current_invalid_routes. A bit test.'''
+        return route in self.route_id and \
+            bool(self.current_invalid_routes_mask >> self.route_id[route] & 1)
+
+    @property
+    def locked_routes_due_to_train(self):
+        _locked_routes = []
+        for _, r in self.curr_train_with_route.items():
+            _locked_routes.append(r)
+            _locked_routes.extend(self._mutex_routes_by_route.get(r))
+        return _locked_routes
 
     @property
     def current_routes(self):
-        for r1, r2 in permutations(self._current_routes, 2):
-            assert r1 not in self.mutex_routes_by_route[r2]
-            assert r2 not in self.mutex_routes_by_route[r1]
-            assert r1[1] not in self.ban_ports_by_port[r1[0]]
-            assert r2[1] not in self.ban_ports_by_port[r2[0]]
         return self._current_routes
 
     @current_routes.setter
@@ -588,9 +772,29 @@ class CtrlPoint(InterlockingPoint):
         for i in new_route_list:
             assert i in self.all_valid_routes
         self._current_routes = new_route_list
+        self.assert_current_routes()
+        self.system.state_version += 1
+        self.system.routing_version += 1
+
+    def assert_current_routes(self):
+        '''
+            Check that the open routes are neither mutex to each other nor
+            banned, whenever they change.
+            @return: None'''
+        _mask = self.routes_mask(self._current_routes)
+        for r in self._current_routes:
+            _bit = 1 << self.route_id[r]
+            assert not self._mutex_mask_by_route[r] & _mask & ~_bit
+            assert not self._ban_ports_mask & _bit
+
+    def freeze(self):
+        super().freeze()
+        self._frozen_vertex = self.vertex
 
     @property
     def banned_paths(self):
+        if self._frozen_banned_paths is not None:
+            return self._frozen_banned_paths
         def collect_banned_paths(skeleton=False):
             _banned_collection = []
             for p in self.ports:
@@ -631,25 +835,33 @@ class CtrlPoint(InterlockingPoint):
                 # in all_valid_routes: the route to open is not banned;
                 # the route-to-open is still possible to conflict with 
                 # existing routes
-                if route not in self.current_invalid_routes:
+                if not self.is_invalid_route(route):
                     self.current_routes.append(route)
+                    self.assert_current_routes()
+                    self.system.state_version += 1
+                    self.system.routing_version += 1
                     self.set_bigblock_routing_by_CtrlPoint_route(route)
                     print('\troute {} of {} is opened'.format(route, self))
                 else:
                     # try to close conflicting routes if possible
                     conflict_routes_of_route_to_open = []
+                    _bit = 1 << self.route_id[route]
                     for cr in self.current_routes:
-                        if route not in self.non_mutex_routes_by_route[cr]:
+                        if self._conflict_mask_by_route[cr] & _bit:
                             conflict_routes_of_route_to_open.append(cr)
                     try:
                         for cr in conflict_routes_of_route_to_open:
                             self.close_route(cr)
                         self.current_routes.append(route)
+                        self.system.state_version += 1
+                        self.system.routing_version += 1
                         self.set_bigblock_routing_by_CtrlPoint_route(route)
                         print('\troute {} of {} is opened'.format(route, self))
                     except:
                         print('\troute {} of {} failed to open because \
                                 conflicting routes are protected')
+                    else:
+                        self.assert_current_routes()
                     finally:
                         pass
                 # CtrlPoint port traffic routing: route[0] -> route[1]
@@ -667,6 +879,8 @@ class CtrlPoint(InterlockingPoint):
             if not _impacted_trns or \
                 all([t.curr_route_cancelable for t in _impacted_trns]):
                 self.current_routes.remove(route)
+                self.system.state_version += 1
+                self.system.routing_version += 1
                 if self.bigblock_by_port.get(route[0]):
                     if not self.bigblock_by_port.get(route[0]).train:
                         self.cancel_bigblock_routing_by_port(route[0])
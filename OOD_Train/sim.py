@@ -45,16 +45,18 @@ def string_diagram(sys):
     start_time, end_time = sys.init_time, sys.term_time
     colors = ['red','green','blue','black','orange','cyan','magenta']
     color_num = len(colors)
-    t_color = [colors[i%color_num] for i in range(len(sys.trains))]
+    trains = sys.trains.history
+    # retired trains included
+    t_color = [colors[i%color_num] for i in range(len(trains))]
     x, y = [], []
     plt.clf()
-    for i in range(len(sys.trains)):
-        x.append([mdates.date2num(datetime.fromtimestamp(j)) for (j,_) in sys.trains[i].time_pos_list])
-        y.append([j for (_,j) in sys.trains[i].time_pos_list])
-        plt.plot([mdates.date2num(datetime.fromtimestamp(j)) for (j,_) in sys.trains[i].time_pos_list], \
-                 [j for (_,j) in sys.trains[i].time_pos_list], color=t_color[i])
+    for i in range(len(trains)):
+        x.append([mdates.date2num(datetime.fromtimestamp(j)) for (j,_) in trains[i].time_pos_list])
+        y.append([j for (_,j) in trains[i].time_pos_list])
+        plt.plot([mdates.date2num(datetime.fromtimestamp(j)) for (j,_) in trains[i].time_pos_list], \
+                 [j for (_,j) in trains[i].time_pos_list], color=t_color[i])
 
-    train_idx = list(range(len(sys.trains)))
+    train_idx = list(range(len(trains)))
     min_t, max_t = min([i[0] for i in x if i]), max([i[-1] for i in x if i])
 
     
@@ -153,27 +155,14 @@ def simulation_setup():
     return sys
 
 def launch(sys, downtrain=True):
-    while sys.sys_time - sys.init_time <= sys.term_time - sys.init_time:
-        _semaphore_to_return = False
-        for t in sys.trains:
-            t.request_routing()
-            t.update_acc()
-        if sys.sys_time+sys.refresh_time - sys.last_train_init_time >= sys.headway:
-            if downtrain:
-                if not sys.signal_points[0].curr_train_with_route.keys():
-                    if all([t.curr_routing_path_segment != ((None,None),(sys.signal_points[0],0)) for t in sys.trains]):
-                        if not sys.signal_points[0].track_by_port[1].train:
-                            t = sys.generate_train( sys.signal_points[0],0,
-                                                    sys.signal_points[10],1,
-                                                    length=1)
-            else:
-                if not sys.signal_points[10].curr_train_with_route.keys():
-                    if all([t.curr_routing_path_segment != ((None,None),(sys.signal_points[10],1)) for t in sys.trains]):
-                        if not sys.signal_points[10].track_by_port[0].train:
-                            t = sys.generate_train( sys.signal_points[10],1,
-                                                    sys.signal_points[0],0,
-                                                    length=1)
-        sys.sys_time+=sys.refresh_time
+    if downtrain:
+        _init_pointport = (sys.signal_points[0], 0)
+        _dest_pointport = (sys.signal_points[10], 1)
+    else:
+        _init_pointport = (sys.signal_points[10], 1)
+        _dest_pointport = (sys.signal_points[0], 0)
+    sys.launch(sys.term_time - sys.init_time, auto_generate_train=True,
+               init_pointport=_init_pointport, dest_pointport=_dest_pointport)
 
 if __name__ == "__main__":
     sys = simulation_setup()
@@ -20,6 +20,7 @@
 import copy
 import logging
 import random
+from collections import Counter
 from collections.abc import MutableSequence
 from datetime import datetime, timedelta
 from itertools import combinations, permutations
@@ -27,8 +28,14 @@ from itertools import combinations, permutations
 import networkx as nx
 import numpy as np
 
-from rail_networkx import all_simple_paths, shortest_path
+from aspects import AspectCore
+from event import EventQueue
+from rail_networkx import RailGraph, all_simple_paths, shortest_path
 from infrastructure import BigBlock, Track, Yard
+from kinematics import KinematicsCore
+from network_constructor import (TEST_NETWORK, build_network, compile_network,
+                                 load_spec)
+from profiler import TickProfiler
 from signaling import Aspect, AutoPoint, AutoSignal, CtrlPoint, HomeSignal
 from train import Train, TrainList
 
@@ -58,19 +65,77 @@ class System():
         :acc_container: list (**kw), miles/(sec)^2
             A list of randomized acceleration values for trains to initialize by. 
         :dcc_container: list (**kw), miles/(sec)^2
-            A list of randomized deceleration values for trains to brake by."""
+            A list of randomized deceleration values for trains to brake by.
+        :vectorized_kinematics: bool (**kw)
+            Update the trains by the NumPy KinematicsCore. False by default.
+        :vectorized_aspects: bool (**kw)
+            Compute the aspects of all signals by the NumPy AspectCore. False
+            by default.
+        :audit_positions: bool (**kw)
+            Check the stored positions of the running trains against the
+            derived ones (Train.audit_position) every refreshing cycle. False
+            by default.
+        :profile: bool or str (**kw)
+            Instrument the refreshing cycles with a TickProfiler and report at
+            the end of launch. A str is the path of the JSON dump of the report.
+            False by default.
+        :network: dict, str or callable (**kw)
+            Network spec (see network_constructor.load_spec), e.g.
+            network_constructor.generate_network(...), or path of its JSON
+            file, compiled once per content by compile_network.
+            Or a builder called with the System and returning the (nodes,
+            tracks) for graph_constructor, e.g.
+            lambda system: network_constructor.build_network(system, spec)
+            to build a spec without compiling it.
+            The test network (test_network.json) by default.
+        :network_cache: str (**kw)
+            Directory where compiled network specs are kept across processes.
+            None by default (kept in memory of the process only)."""
 
     def __init__(self, init_time, *args, **kwargs):
         super().__init__()
 
+        self.events = EventQueue()
+        # next refreshing cycle and scheduled actions, run by System.launch
+        self.state_version = 0
+        # counter bumped at every change of routes, routings and track
+        # occupancy. Trains idle while it is unchanged.
+        self.routing_version = 0
+        # counter bumped at every change of routes and routings only.
+        self.occupancy_version = 0
+        # counter bumped at every change of track occupancy only.
+        self._parallel_tracks = {}
+        # number of parallel tracks by (init_point, dest_point), static
+        self._capacity_version = None
+        self._capacity_enterable = {}
+        # capacity_enterable by (init_point, dest_point), per occupancy_version
+        self._point_pairs_between = {}
+        # adjacent point pairs of all paths by (from_point, to_point), static
+        self._trains_between_version = None
+        self._trains_between = {}
+        # trains between (from_point, to_point), per occupancy_version
+        self._routing_paths_version = None
+        self._routing_paths = []
+        self._routing_path_by_routing = {}
+        # index of curr_routing_paths, rebuilt once per routing_version
         self.sys_time = init_time.timestamp()
         # CPU format time in sec, transferable to numerical value or str values
         self.init_time = init_time.timestamp()
         self.term_time = float('inf') \
             if kwargs.get('term_time') is None \
             else kwargs.get('term_time').timestamp()
-        self.G_origin = self.graph_constructor()
-        self.G_skeleton = self.graph_extractor(self.G_origin)
+        self.frozen = False
+        # static properties computed once, see freeze
+        self._frozen_sys_min_dcc = None
+        self.sign_by_segment = None
+        if callable(kwargs.get('network')):
+            self.G_origin = self.graph_constructor(*kwargs['network'](self))
+            self.G_skeleton = self.graph_extractor(self.G_origin)
+        else:
+            self.G_origin, self.G_skeleton = compile_network(
+                self, TEST_NETWORK if kwargs.get('network') is None
+                else kwargs.get('network'),
+                cache_dir=kwargs.get('network_cache'))
 
         self.signal_points = list(self.G_origin.nodes())
         # list of all SignalPoints, including AutoPoints and CtrlPoints
@@ -85,6 +150,9 @@ class System():
         self.bigblocks = [data['instance']
             for (u, v, data) in list(self.G_skeleton.edges(data=True))]
         # list of all BigBlocks.
+        self.freeze()
+        self.build_reachability()
+        # reachable SignalPoints of every Signal, see Signal.reachable
         self.dos_period = [datetime.strptime(t, "%Y-%m-%d %H:%M:%S").timestamp()
             for t in kwargs.get('dos_period') if type(t) == str]
         self.dos_pos = (None,None) \
@@ -100,13 +168,26 @@ class System():
             if args else [random.uniform(_min_spd, _max_spd) for i in range(20)]
         self.acc_container = args[1]\
             if args else [random.uniform(_min_acc, _max_acc) for i in range(20)]
+        _min_dcc = self.sys_min_dcc
+        # scans all tracks: computed once
         self.dcc_container = args[2]\
-            if args else [random.uniform(self.sys_min_dcc*1.15, self.sys_min_dcc*1.25) for i in range(20)]
-        self.dcc_container = [i if i >= self.sys_min_dcc else self.sys_min_dcc
+            if args else [random.uniform(_min_dcc*1.15, _min_dcc*1.25) for i in range(20)]
+        self.dcc_container = [i if i >= _min_dcc else _min_dcc
             for i in self.dcc_container]
         self.refresh_time = 1 if kwargs.get('refresh_time') is None \
             else kwargs.get('refresh_time')
         self.dispatcher = None
+        self.kinematics = KinematicsCore(self) \
+            if kwargs.get('vectorized_kinematics') else None
+        # optional vectorized kinematics of trains, see kinematics.py
+        self.aspects = AspectCore(self) \
+            if kwargs.get('vectorized_aspects') else None
+        # optional vectorized aspects of signals, see aspects.py
+        self.audit_positions = bool(kwargs.get('audit_positions'))
+        self.profiler = None if not kwargs.get('profile') else TickProfiler(
+            self, dump_path=kwargs.get('profile')
+            if isinstance(kwargs.get('profile'), str) else None)
+        # optional tick instrumentation, see profiler.py
         # self.register(self.blocks)
         # register method links the observation relationships
 
@@ -118,6 +199,8 @@ class System():
             than this value, it may violate some signal/speed limits at extreme 
             scenarios. When violated, the program will throw AssertionErrors at 
             braking distance/speed limit check.'''
+        if self._frozen_sys_min_dcc is not None:
+            return self._frozen_sys_min_dcc
         _signal_speeds = sorted(
             [spd for _, spd in Aspect.COLOR_SPD_DICT.items()])
         _speed_diff_pairs = [(_signal_speeds[i], _signal_speeds[i + 1])
@@ -135,7 +218,9 @@ class System():
 
     @property
     def train_num(self):
-        return len(self.trains)
+        '''
+            Number of trains ever generated, retired trains included.'''
+        return self.trains.generated
 
     @property
     def curr_routing_paths(self):
@@ -143,7 +228,31 @@ class System():
             A list of all currently cleared routing path lists inside the system.
             Each routing path list has the direction and segments information of
             the limit of movement authority cleared for a certain train.
-            Each routing path list consists of routing tuples (2-element-tuple)'''
+            Each routing path list consists of routing tuples (2-element-tuple)
+            The lists are shared until the next routing change: do not modify.'''
+        if self._routing_paths_version != self.routing_version:
+            self._routing_paths = self.build_routing_paths()
+            self._routing_path_by_routing = {}
+            for rp in self._routing_paths:
+                for routing in rp:
+                    self._routing_path_by_routing.setdefault(routing, rp)
+            self._routing_paths_version = self.routing_version
+        return self._routing_paths
+
+    def routing_path_by_routing(self, routing):
+        '''
+            The first currently cleared routing path list containing the
+            routing tuple. None if the routing is not cleared.'''
+        if self._routing_paths_version != self.routing_version:
+            self.curr_routing_paths
+        return self._routing_path_by_routing.get(routing)
+
+    def build_routing_paths(self):
+        '''
+            Build the list of all currently cleared routing path lists by
+            connecting the routing paths of all BigBlocks and vertex CtrlPoints.
+            Use curr_routing_paths instead, which is rebuilt only when routes
+            or routings change.'''
 
         def has_repeating_routing_paths(rplist, traversed):
             '''
@@ -231,100 +340,118 @@ class System():
         pass
 
     def get_track_by_point_port_pairs(self, p1, p1_port, p2, p2_port):
-        for t in self.tracks:
-            if p1 in (t.L_point, t.R_point) and p2 in (t.L_point, t.R_point):
-                if p1_port in (t.L_point_port, t.R_point_port) \
-                        and p2_port in (t.L_point_port, t.R_point_port):
-                    return t
-        return None
+        '''
+            The Track having both points and both ports (in any order).
+            None if no such Track exists.'''
+        return self._track_by_point_port_pairs.get(
+            (frozenset((p1, p2)), frozenset((p1_port, p2_port))))
+
+    def build_track_index(self, G):
+        '''
+            Build the index of Tracks by their (unordered) end points and ports,
+            serving get_track_by_point_port_pairs. Built by graph_constructor;
+            call again after editing the topology of the graph G.
+            Keys are (points, ports) frozensets of any non-empty subsets of the
+            end points and ports of a Track: the first Track in the edge order
+            of G is kept for each key, as a linear scan over the Tracks would.
+            @return: None'''
+        self._track_by_point_port_pairs = {}
+        for (_, _, data) in G.edges(data=True):
+            t = data['instance']
+            for points in ((t.L_point,), (t.R_point,), (t.L_point, t.R_point)):
+                for ports in ((t.L_point_port,), (t.R_point_port,),
+                              (t.L_point_port, t.R_point_port)):
+                    self._track_by_point_port_pairs.setdefault(
+                        (frozenset(points), frozenset(ports)), t)
+
+    def freeze(self):
+        '''
+            Compute the static properties of the network once, served from
+            attributes afterwards: MP and length of Tracks and BigBlocks,
+            facing direction of Signals, vertex, bigblock and banned_paths of
+            SignalPoints, sys_min_dcc and the signs of the routing path
+            segments (sign_by_segment). Called after graph_extractor.
+            The topology is fixed afterwards: changing G_origin or G_skeleton
+            or the MP of a Signal raises FrozenTopologyError.
+            @return: None'''
+        for t in self.tracks + self.bigblocks:
+            t.freeze()
+        for p in self.signal_points:
+            p.freeze()
+        self._frozen_sys_min_dcc = self.sys_min_dcc
+        self.sign_by_segment = self.build_sign_table()
+        self.G_origin.freeze()
+        self.G_skeleton.freeze()
+        self.frozen = True
+
+    def build_sign_table(self):
+        '''
+            Sign (+1/-1) of the direction of every legal routing path segment,
+            serving Track.sign_routing and Train.sign_MP: both directions of
+            the Tracks and BigBlocks, and the virtual initiating/terminating
+            segments at the ports without track of the vertex points.
+            Segments of undefined direction are left out (computed, and
+            raising, on use).
+            @return: dict {((Point, Port), (Point, Port)): int}'''
+        _segments = []
+        for t in self.tracks + self.bigblocks:
+            _segments.append(((t.L_point, t.L_point_port),
+                              (t.R_point, t.R_point_port)))
+            _segments.append(((t.R_point, t.R_point_port),
+                              (t.L_point, t.L_point_port)))
+        for cp in self.vertex_points:
+            for port in cp.ports:
+                if not cp.track_by_port.get(port):
+                    _segments.append(((None, None), (cp, port)))
+                    _segments.append(((cp, port), (None, None)))
+        _signs = {}
+        for seg in _segments:
+            try:
+                _sign = Track.compute_sign_routing(seg)
+            except (AssertionError, KeyError, ValueError):
+                continue
+            if _sign is not None:
+                _signs[seg] = _sign
+        return _signs
+
+    def build_reachability(self):
+        '''
+            Build the reachable SignalPoints of every Signal, serving
+            Signal.reachable: the points of the routes (G_origin paths without
+            banned transitions) leaving the signal point to its
+            following_sigpoints, the signal point excluded. Stored as bitsets,
+            bit i for the i-th node of G_origin.
+            Call again after editing the topology of G_origin.
+            @return: None'''
+        _csr = self.G_origin.csr
+        _reach_by_state = _csr.reach_by_state()
+        self._reachable_bit_by_point = {
+            p: 1 << i for (i, p) in enumerate(_csr.nodes)}
+        self._reachable_points_by_signal = {}
+        for (i, p) in enumerate(_csr.nodes):
+            for sig in p.signal_by_port.values():
+                try:
+                    _following = sig.following_sigpoints
+                except (KeyError, AttributeError):
+                    _following = []
+                    # a port to enter has no track: nothing is reachable
+                _bits = 0
+                for f in set(_following):
+                    _bits |= _reach_by_state.get((i, _csr.node_id[f]), 0)
+                self._reachable_points_by_signal[sig] = \
+                    _bits & ~(1 << i) if _bits >> i & 1 else _bits
 
     def graph_constructor(self, node={}, track={}):
         '''Initialize the MultiGraph object with railroad components 
         (CP, AT as nodes, Tracks as edges)'''
-        # TODO: construct the nbunch and ebunch list for Graph in network_constructor.py
         # TODO: automation of port connecting and index assignment
-        # TODO: to be achieved in network_constructor.py
-        TEST_SIDINGS = [Yard(self), Yard(self), Yard(self), Yard(self)]
-
-        TEST_NODE = {   0: CtrlPoint( self, idx=0, ports=[0, 1], MP=0.0),
-                        1: AutoPoint(    self, idx=1, MP=5.0),
-                        2: AutoPoint(    self, idx=2, MP=10.0),
-                        3: CtrlPoint( self, idx=3, ports=[0, 1, 3], ban_ports_by_port={1: [3], 3: [1]}, MP=15.0),
-                        4: CtrlPoint( self, idx=4, ports=[0, 2, 1], ban_ports_by_port={0: [2], 2: [0]}, MP=20.0),
-                        5: AutoPoint(    self, idx=5, MP=25.0),
-                        6: CtrlPoint( self, idx=6, ports=[0, 1, 3], ban_ports_by_port={1: [3], 3: [1]}, MP=30.0),
-                        7: CtrlPoint( self, idx=7, ports=[0, 2, 1], ban_ports_by_port={0: [2], 2: [0]}, MP=35.0),
-                        8: AutoPoint(    self, idx=8, MP=40.0),
-                        9: AutoPoint(    self, idx=9, MP=45.0),
-                        10: CtrlPoint(self, idx=10, ports=[0, 1], MP=50.0)
-        }   # yapf: disable
-
-        TEST_TRACK = [
-            Track(self, TEST_NODE[0], 1, TEST_NODE[1], 0),
-            Track(self, TEST_NODE[1], 1, TEST_NODE[2], 0),
-            Track(self, TEST_NODE[2], 1, TEST_NODE[3], 0),
-            Track(self, TEST_NODE[3], 1, TEST_NODE[4], 0, edge_key=0, yard=TEST_SIDINGS[1]),
-            Track(self, TEST_NODE[3], 3, TEST_NODE[4], 2, edge_key=1, yard=TEST_SIDINGS[1]),
-            Track(self, TEST_NODE[4], 1, TEST_NODE[5], 0),
-            Track(self, TEST_NODE[5], 1, TEST_NODE[6], 0),
-            Track(self, TEST_NODE[6], 1, TEST_NODE[7], 0, edge_key=0, yard=TEST_SIDINGS[2]),
-            Track(self, TEST_NODE[6], 3, TEST_NODE[7], 2, edge_key=1, yard=TEST_SIDINGS[2]),
-            Track(self, TEST_NODE[7], 1, TEST_NODE[8], 0),
-            Track(self, TEST_NODE[8], 1, TEST_NODE[9], 0),
-            Track(self, TEST_NODE[9], 1, TEST_NODE[10], 0)
-        ]   # yapf: disable
-
-        TEST_SIDINGS = [Yard(self), Yard(self), Yard(self), Yard(self), Yard(self), Yard(self)]
-
-        TEST_NODE = {   0: CtrlPoint( self, idx=0, ports=[0, 1], ban_ports_by_port={0: [0], 1: [1]}, MP=0.0),
-                        1: AutoPoint(    self, idx=1, MP=5.0),
-                        2: CtrlPoint( self, idx=2, ports=[0, 1, 3], ban_ports_by_port={1: [1, 3], 3: [3, 1]}, MP=10.0),
-                        3: CtrlPoint( self, idx=3, ports=[0, 1, 3], ban_ports_by_port={1: [1, 3], 3: [3, 1]}, MP=15.0),
-                        4: CtrlPoint( self, idx=4, ports=[0, 2, 1], ban_ports_by_port={0: [0, 2], 2: [2, 0]}, MP=20.0),
-                        5: CtrlPoint( self, idx=5, ports=[0, 1, 3], ban_ports_by_port={1: [1, 3], 3: [3, 1]}, MP=25.0),
-                        6: CtrlPoint( self, idx=6, ports=[0, 1, 3], ban_ports_by_port={1: [1, 3], 3: [3, 1]}, MP=30.0),
-                        7: CtrlPoint( self, idx=7, ports=[0, 2, 1], ban_ports_by_port={0: [0, 2], 2: [2, 0]}, MP=35.0),
-                        8: CtrlPoint( self, idx=8, ports=[0, 2, 1], ban_ports_by_port={0: [0, 2], 2: [2, 0]}, MP=40.0),
-                        9: AutoPoint(    self, idx=9, MP=45.0),
-                        10: CtrlPoint(self, idx=10, ports=[0, 1], ban_ports_by_port={0: [0], 1: [1]}, MP=50.0),
-                        11: AutoPoint(   self, idx=11, MP=30.0),
-                        12: AutoPoint(   self, idx=12, MP=35.0),
-                        13: CtrlPoint(self, idx=13, ports=[0, 1], ban_ports_by_port={0: [0], 1: [1]}, MP=20.0),
-                        14: CtrlPoint(self, idx=14, ports=[0, 1, 3], ban_ports_by_port={1: [1, 3], 3: [3, 1]}, MP=5.0),
-                        15: AutoPoint(   self, idx=15, MP=10.0),
-                        16: CtrlPoint(self, idx=16, ports=[0, 2, 1], ban_ports_by_port={0: [0, 2], 2: [2, 0]}, MP=15.0),
-        }   # yapf: disable
-
-        TEST_TRACK = [
-            Track(self, TEST_NODE[0], 1, TEST_NODE[1], 0, mainline=True),
-            Track(self, TEST_NODE[1], 1, TEST_NODE[2], 0, mainline=True),
-            Track(self, TEST_NODE[2], 1, TEST_NODE[3], 0, mainline=True),
-            Track(self, TEST_NODE[3], 1, TEST_NODE[4], 0, edge_key=0, yard=TEST_SIDINGS[1], mainline=True),
-            Track(self, TEST_NODE[3], 3, TEST_NODE[4], 2, edge_key=1, yard=TEST_SIDINGS[1]),
-            Track(self, TEST_NODE[4], 1, TEST_NODE[5], 0, mainline=True),
-            Track(self, TEST_NODE[5], 1, TEST_NODE[6], 0, mainline=True),
-            Track(self, TEST_NODE[6], 1, TEST_NODE[7], 0, edge_key=0, yard=TEST_SIDINGS[2], mainline=True),
-            Track(self, TEST_NODE[6], 3, TEST_NODE[7], 2, edge_key=1, yard=TEST_SIDINGS[2]),
-            Track(self, TEST_NODE[7], 1, TEST_NODE[8], 0, mainline=True),
-            Track(self, TEST_NODE[8], 1, TEST_NODE[9], 0, mainline=True),
-            Track(self, TEST_NODE[9], 1, TEST_NODE[10],0, mainline=True),
-            Track(self, TEST_NODE[5], 3, TEST_NODE[11],0, yard=TEST_SIDINGS[2]),
-            Track(self, TEST_NODE[11],1, TEST_NODE[12],0, yard=TEST_SIDINGS[2]),
-            Track(self, TEST_NODE[12],1, TEST_NODE[8], 2, yard=TEST_SIDINGS[2]),
-            Track(self, TEST_NODE[2], 3, TEST_NODE[14],0, mainline=True),
-            Track(self, TEST_NODE[14],3, TEST_NODE[15],0, yard=TEST_SIDINGS[3]),
-            Track(self, TEST_NODE[15],1, TEST_NODE[16],2, yard=TEST_SIDINGS[3]),
-            Track(self, TEST_NODE[14],1, TEST_NODE[16],0, yard=TEST_SIDINGS[3], mainline=True),
-            Track(self, TEST_NODE[16],1, TEST_NODE[13],0, mainline=True),
-        ]   # yapf: disable
-
-        _node = TEST_NODE if not node else node
+        _node, _track = (node, track) if node \
+            else build_network(self, load_spec(TEST_NETWORK))
+        # the test network by default, see test_network.json
         nbunch = [_node[i] for i in range(len(_node))]
-        _track = TEST_TRACK if not track else track
         ebunch = [_track[i] for i in range(len(_track))]
 
-        # _node and _track will be parameters passed from outside in the future development
-        G = nx.MultiGraph()
+        G = RailGraph()
         for n in nbunch:
             G.add_node(n, attr=n.__dict__, instance=n)
             # __dict__ of instances (CPs, ATs, Tracks) is pointing the same
@@ -349,6 +476,7 @@ class System():
             i.neighbor_nodes.extend([n for n in G.neighbors(i)])
             for n in G.neighbors(i):
                 i.add_observer(n)
+        self.build_track_index(G)
         return G
 
     def graph_extractor(self, G):
@@ -506,9 +634,32 @@ class System():
                 Hold new train for capacity.')
         return _new_train
 
+    def occupancy_changed(self, *tracks):
+        '''
+            Called when a train enters/exits a track, or its segment changes,
+            with the tracks entered/exited: their observers are notified.
+            @return: None'''
+        self.state_version += 1
+        self.occupancy_version += 1
+        for t in tracks:
+            if t is not None:
+                t.listener_updates(obj='occupancy')
+        if self.aspects is not None:
+            self.aspects.occupancy_changed(tracks)
+
     def capacity_enterable(self, init_point, dest_point):
         '''
-            Determines if a train could cross init_point towards dest_point.'''
+            Determines if a train could cross init_point towards dest_point.
+            Results are kept until the track occupancy changes.'''
+        if self._capacity_version != self.occupancy_version:
+            self._capacity_enterable = {}
+            self._capacity_version = self.occupancy_version
+        if (init_point, dest_point) not in self._capacity_enterable:
+            self._capacity_enterable[(init_point, dest_point)] = \
+                self._capacity_enterable_by_occupancy(init_point, dest_point)
+        return self._capacity_enterable[(init_point, dest_point)]
+
+    def _capacity_enterable_by_occupancy(self, init_point, dest_point):
         _parallel_tracks = self.num_parallel_tracks(init_point, dest_point)
         _outbound_trains = self.get_trains_between_points(from_point=init_point,
                                                           to_point=dest_point,
@@ -522,6 +673,15 @@ class System():
             <= _parallel_tracks - _occupied_parallel_tracks else False
 
     def num_parallel_tracks(self, init_point, dest_point):
+        '''
+            Number of parallel tracks between init_point and dest_point along
+            the mainline. Depends on the topology only: computed once per pair.'''
+        if (init_point, dest_point) not in self._parallel_tracks:
+            self._parallel_tracks[(init_point, dest_point)] = \
+                self._count_parallel_tracks(init_point, dest_point)
+        return self._parallel_tracks[(init_point, dest_point)]
+
+    def _count_parallel_tracks(self, init_point, dest_point):
         _mainline_path = shortest_path(self.G_origin, source=init_point, 
                                 target=dest_point, weight='weight_mainline')
         _head = _mainline_path.pop(0)
@@ -551,13 +711,24 @@ class System():
                                                      to_point=dest_point,
                                                      obv=True,
                                                      rev=True)
-        test_G = self.G_origin.copy()
+        # edges removed from G_origin by the trains, without copying it:
+        # each train takes out one of the parallel edges of its segment.
+        _csr = self.G_origin.csr
+        (_source, _target) = (_csr.node_id[init_point],
+                              _csr.node_id[dest_point])
+        _removed = Counter()
         count = 0
         for t in _all_trains:
-            test_G.remove_edge(t.curr_routing_path_segment[0][0],
-                               t.curr_routing_path_segment[1][0])
-            if nx.has_path(test_G, init_point, dest_point) and \
-                Train.sign_MP(t.curr_routing_path_segment) * \
+            (_u, _v) = (t.curr_routing_path_segment[0][0],
+                        t.curr_routing_path_segment[1][0])
+            (_i, _j) = sorted((_csr.node_id.get(_u, -1),
+                               _csr.node_id.get(_v, -1)))
+            if _removed[(_i, _j)] >= _csr.number_of_edges(_i, _j):
+                raise nx.NetworkXError(
+                    'The edge {}-{} is not in the graph'.format(_u, _v))
+            _removed[(_i, _j)] += 1
+            if _csr.has_path_without(_source, _target, _removed) and \
+                t.curr_sign * \
                     (dest_point.MP-init_point.MP) > 0:
                 count += 1
         return count
@@ -571,60 +742,221 @@ class System():
             Given a pair of O-D in the system, return all trains running between 
             this pair of O-D nodes.
             @option: filter trains running at the obversed/reversed direction 
-            compared with the from-to path.'''
-        all_paths = list(all_simple_paths(self.G_origin, from_point, to_point))
+            compared with the from-to path.
+            Results are kept until the track occupancy changes.'''
+        if self._trains_between_version != self.occupancy_version:
+            self._trains_between = {}
+            self._trains_between_version = self.occupancy_version
+        if (from_point, to_point) not in self._trains_between:
+            self._trains_between[(from_point, to_point)] = \
+                self._trains_on_point_pairs(
+                    self.point_pairs_between(from_point, to_point))
+        (_trains_all, _trains_obv_dir, _trains_rev_dir) = \
+            self._trains_between[(from_point, to_point)]
+        if obv == True and rev == True: return list(_trains_all)
+        elif obv == True: return list(_trains_obv_dir)
+        elif rev == True: return list(_trains_rev_dir)
+        else: return []
+
+    def point_pairs_between(self, from_point, to_point):
+        '''
+            Pairs of adjacent points (p[i], p[i+1]) of all paths p from
+            from_point to to_point, without repetition, in the order met when
+            traversing the paths. Depends on the topology only: computed once
+            per O-D pair.'''
+        if (from_point, to_point) not in self._point_pairs_between:
+            _pairs = []
+            _seen = set()
+            for p in all_simple_paths(self.G_origin, from_point, to_point):
+                for i in range(len(p) - 1):
+                    if (p[i], p[i + 1]) not in _seen:
+                        _seen.add((p[i], p[i + 1]))
+                        _pairs.append((p[i], p[i + 1]))
+            self._point_pairs_between[(from_point, to_point)] = _pairs
+        return self._point_pairs_between[(from_point, to_point)]
+
+    def _trains_on_point_pairs(self, pairs):
+        '''
+            Trains running on the tracks between each pair of points, all and
+            by obversed/reversed direction, in the order of pairs.'''
         _trains_all = []
         _trains_obv_dir = []
         _trains_rev_dir = []
-        for p in all_paths:
-            for i in range(len(p) - 1):
-                for k in list(self.G_origin[p[i]][p[i + 1]]):
-                    for t in self.G_origin[p[i]][p[i + 1]][k]['instance'].train:
-                        if t.curr_routing_path_segment[0][0] in (p[i], p[i+1]) \
-                        and t.curr_routing_path_segment[1][0] in (p[i], p[i+1]):
-                            if t not in _trains_all:
-                                _trains_all.append(t)
-                            if (t.curr_routing_path_segment[0][0],
-                                    t.curr_routing_path_segment[1][0]) == \
-                                        (p[i], p[i + 1]):
-                                if t not in _trains_obv_dir:
-                                    _trains_obv_dir.append(t)
-                            if (t.curr_routing_path_segment[0][0],
-                                    t.curr_routing_path_segment[1][0]) == \
-                                        (p[i + 1], p[i]):
-                                if t not in _trains_rev_dir:
-                                    _trains_rev_dir.append(t)
-        if obv == True and rev == True: return _trains_all
-        elif obv == True: return _trains_obv_dir
-        elif rev == True: return _trains_rev_dir
-        else: return []
-
-    def launch(self, launch_duration, auto_generate_train=False):
+        _seen_all, _seen_obv, _seen_rev = set(), set(), set()
+        for (u, v) in pairs:
+            for k, data in self.G_origin[u][v].items():
+                for t in data['instance'].train:
+                    _seg = (t.curr_routing_path_segment[0][0],
+                            t.curr_routing_path_segment[1][0])
+                    if _seg[0] in (u, v) and _seg[1] in (u, v):
+                        if t not in _seen_all:
+                            _seen_all.add(t)
+                            _trains_all.append(t)
+                        if _seg == (u, v) and t not in _seen_obv:
+                            _seen_obv.add(t)
+                            _trains_obv_dir.append(t)
+                        if _seg == (v, u) and t not in _seen_rev:
+                            _seen_rev.add(t)
+                            _trains_rev_dir.append(t)
+        return _trains_all, _trains_obv_dir, _trains_rev_dir
+
+    def schedule(self, time, action, priority=1, name=None):
+        '''
+            Schedule an action (callable without arguments) on the event queue
+            of the System. Scheduled actions are executed by System.launch in
+            time order with the refreshing cycles, after the refreshing cycle
+            of the same time. Only refreshing cycles advance sys_time.
+            @return: Event instance.'''
+        return self.events.schedule(time, action, priority=priority, name=name)
+
+    def launch(self, launch_duration, auto_generate_train=False,
+               init_pointport=None, dest_pointport=None):
+        '''
+            Run the simulation until launch_duration seconds after init_time.
+            Time advances in fixed steps of refresh_time: every refreshing
+            cycle is put on the event queue by the previous one, and actions
+            scheduled with System.schedule run in between. This is not a
+            next-event simulation; what is saved is the work on idle trains.
+            A train that is stopped with nothing to request (and asks no route
+            to the Dispatcher) is set idle and skipped until the routes,
+            routings or track occupancy of the System change; its records are
+            filled up when it resumes. When all trains are idle or terminated,
+            refreshing cycles are fast-forwarded to the next train generation.
+            ----------
+            :init_pointport/dest_pointport: (Point, Port)
+                Entry and exit of the trains generated automatically.
+                CtrlPoint 0 (port 0) to CtrlPoint 10 (port 1) by default.'''
         logging.info("Thread %s: starting", 'simulator')
-        while self.sys_time - self.init_time <= launch_duration:
-            for t in self.trains:
-                try:
-                    t.request_routing()
-                    t.update_acc()
-                except:
-                    print(t)
-                    raise(ValueError('Raise Error to Stop Simulation'))
-            if auto_generate_train:
-                if self.sys_time+self.refresh_time - self.last_train_init_time \
-                        >= self.headway:
-                    if not self.signal_points[0].curr_train_with_route.keys():
-                        if all([t.curr_routing_path_segment != 
-                                ((None,None),(self.signal_points[0],0)) 
-                                for t in self.trains.all_trains]):
-                            if not self.tracks[0].train:
-                                t = self.generate_train(self.signal_points[0],
-                                                        0, 
-                                                        self.signal_points[10], 
-                                                        1, 
-                                                        length=1)
-            self.sys_time += self.refresh_time
+        self._launch_duration = launch_duration
+        self._auto_generate_train = auto_generate_train
+        self._init_pointport = (self.signal_points[0], 0) \
+            if init_pointport is None else init_pointport
+        self._dest_pointport = (self.signal_points[10], 1) \
+            if dest_pointport is None else dest_pointport
+        self._refresh_event = self.events.schedule(
+            self.sys_time, self.refresh_cycle, name='refresh')
+        if self.profiler:
+            self.profiler.instrument()
+        try:
+            while self.events:
+                if self.events.next_time - self.init_time > launch_duration:
+                    break
+                _event = self.events.pop()
+                if self.profiler is None:
+                    _event.action()
+                else:
+                    self.profiler.tick_start()
+                    _event.action()
+                    self.profiler.tick_end(_event)
+        finally:
+            if self.profiler:
+                self.profiler.uninstrument()
+        if self.profiler:
+            print(self.profiler)
+            if self.profiler.dump_path:
+                self.profiler.dump()
+        for t in self.trains.all_trains:
+            t.resume()
+        self.events.cancel(self._refresh_event)
         logging.info("Thread %s: finishing", 'simulator')
 
+    def fork(self, **kwargs):
+        '''
+            Clone the System in the middle of a run, including its trains,
+            routes, occupancy and scheduled events. The clone continues
+            independently by calling its launch with a longer launch_duration,
+            e.g. several DoS branches sharing the same pre-attack simulation.
+            Parameters of the branch can be reset by keywords:
+            ----------
+            :dos_period: [str, str], "%Y-%m-%d %H:%M:%S"
+            :dos_pos: (MP1, MP2)
+            :headway: seconds
+            Trains are generated with the module random: restore its state
+            (random.getstate() at fork time) before launching each branch for
+            branches to be comparable.
+            @return: the new System instance.'''
+        _branch = copy.deepcopy(self)
+        for key, value in kwargs.items():
+            if key == 'dos_period':
+                _branch.dos_period = [
+                    datetime.strptime(t, "%Y-%m-%d %H:%M:%S").timestamp()
+                    for t in value if type(t) == str]
+            elif key in ('dos_pos', 'headway'):
+                setattr(_branch, key, value)
+            else:
+                raise ValueError('{} cannot be reset by fork'.format(key))
+        return _branch
+
+    def refresh_cycle(self):
+        '''
+            Event action of one refreshing cycle: update all running trains,
+            generate new trains if needed, then schedule the next cycle.'''
+        _requested = []
+        if self.kinematics is not None:
+            self.kinematics.prepare([t for t in self.trains.all_trains
+                                     if not (t.terminated or t.idle)])
+        for t in self.trains.all_trains:
+            if t.terminated or t.idle:
+                continue
+            try:
+                t.resume()
+                if self.audit_positions:
+                    t.audit_position()
+                _version = self.state_version
+                t.request_routing()
+                _requested.append((t, _version, t.stopped))
+                if self.kinematics is None:
+                    t.update_acc()
+                else:
+                    self.kinematics.update(t)
+            except:
+                print(t)
+                raise(ValueError('Raise Error to Stop Simulation'))
+        for (t, _version, _stopped) in _requested:
+            if _stopped and _version == self.state_version and \
+                    not t.dispatching and \
+                    not (t.curr_track and t.curr_track.yard):
+                # request_routing() may depend on other trains' positions
+                # in yards. Trains in yards are never idle. Trains asking
+                # for a route draw random choices at every cycle.
+                t.set_idle()
+        for (t, _, _) in _requested:
+            if t.terminated:
+                self.trains.retire(t)
+                # out of the per-tick loops and of the ordering
+        if self._auto_generate_train and self.train_generation_due:
+            (_init_point, _init_port) = self._init_pointport
+            _entry_tracks = [_init_point.track_by_port.get(p) for p in
+                             _init_point.available_ports_by_port[_init_port]]
+            if not _init_point.curr_train_with_route.keys():
+                if all([t.curr_routing_path_segment !=
+                        ((None,None),self._init_pointport)
+                        for t in self.trains.all_trains]):
+                    if not any([trk.train for trk in _entry_tracks if trk]):
+                        t = self.generate_train(_init_point,
+                                                _init_port,
+                                                self._dest_pointport[0],
+                                                self._dest_pointport[1],
+                                                length=1)
+        self.sys_time += self.refresh_time
+        if all([t.terminated or t.idle for t in self.trains.all_trains]):
+            # nothing changes until the next train generation
+            while not (self._auto_generate_train and self.train_generation_due)\
+                    and self.sys_time - self.init_time <= self._launch_duration\
+                    and (self.events.next_time is None
+                         or self.sys_time < self.events.next_time):
+                self.sys_time += self.refresh_time
+        self._refresh_event = self.events.schedule(
+            self.sys_time, self.refresh_cycle, name='refresh')
+
+    @property
+    def train_generation_due(self):
+        '''
+            True if the headway since the last generated train has elapsed by
+            the end of the current refreshing cycle.'''
+        return self.sys_time + self.refresh_time - self.last_train_init_time \
+            >= self.headway
+
     def update_routing(self):
         '''
             TODO: Combine dispatcher actions'''
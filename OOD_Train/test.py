@@ -97,16 +97,18 @@ def run_with_string_diagram(sys, start_time, end_time):
     '''
     colors = ['red', 'green', 'blue', 'black', 'orange', 'cyan', 'magenta']
     color_num = len(colors)
+    trains = sys.trains.history
+    # retired trains included
     x, y = [], []
-    for i in range(len(sys.trains)):
+    for i in range(len(trains)):
         x.append([])
         y.append([])
-        for j in range(len(sys.trains[i].time_pos_list)):
+        for j in range(len(trains[i].time_pos_list)):
             x[i].append(
-                datetime.fromtimestamp(sys.trains[i].time_pos_list[j][0]))
-            y[i].append(sys.trains[i].time_pos_list[j][1])
-            # x[i].append(sys.trains[i].time_pos_list[j][0])
-            # y[i].append(sys.trains[i].time_pos_list[j][1])
+                datetime.fromtimestamp(trains[i].time_pos_list[j][0]))
+            y[i].append(trains[i].time_pos_list[j][1])
+            # x[i].append(trains[i].time_pos_list[j][0])
+            # y[i].append(trains[i].time_pos_list[j][1])
 
     assert len(x) == len(y)
     for i in range(len(x)):
@@ -204,15 +206,17 @@ def speed_curve(sys, train):
 def process_data(sys):
     x = []
     y = []
-    for i in range(len(sys.trains) - 1):
+    trains = sys.trains.history
+    # retired trains included
+    for i in range(len(trains) - 1):
         x.append([])
         y.append([])
-        for j in range(len(sys.trains[i].time_pos_list) - 1):
+        for j in range(len(trains[i].time_pos_list) - 1):
             x[i].append(
-                datetime.fromtimestamp(sys.trains[i].time_pos_list[j][0]))
-            y[i].append(sys.trains[i].time_pos_list[j][1])
-            # x[i].append(sys.trains[i].time_pos_list[j][0])
-            # y[i].append(sys.trains[i].time_pos_list[j][1])
+                datetime.fromtimestamp(trains[i].time_pos_list[j][0]))
+            y[i].append(trains[i].time_pos_list[j][1])
+            # x[i].append(trains[i].time_pos_list[j][0])
+            # y[i].append(trains[i].time_pos_list[j][1])
 
     y = [i for _, i in sorted(zip([i[0] for i in x], y))]
     x = sorted(x, key=lambda x: x[0])
@@ -224,7 +228,7 @@ def cal_delay(sys, sys_dos, delay_miles):
     x_sys = []
     y_sys = []
 
-    no_delay_sorted_train = sorted(sys.trains,
+    no_delay_sorted_train = sorted(sys.trains.history,
                                    key=lambda train: train.train_idx)
     for i in range(len(no_delay_sorted_train) - 1):
         x_sys.append([])
@@ -239,7 +243,7 @@ def cal_delay(sys, sys_dos, delay_miles):
 
     x_sys_dos = []
     y_sys_dos = []
-    delay_sorted_train = sorted(sys_dos.trains,
+    delay_sorted_train = sorted(sys_dos.trains.history,
                                 key=lambda train: train.train_idx)
     for i in range(len(delay_sorted_train) - 1):
         x_sys_dos.append([])
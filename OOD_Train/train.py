@@ -23,45 +23,162 @@ import sys
 sys.path.append(
     'D:\\Users\\Hegxiten\\workspace\\Rutgers_Railway_security_research\\OOD_Train'
 )
+from collections import namedtuple
 from collections.abc import MutableSequence
 from datetime import datetime, timedelta
 
 import numpy as np
 
+from infrastructure import Track
 from signaling import AutoPoint, AutoSignal, CtrlPoint, HomeSignal
 from rail_networkx import all_simple_paths, shortest_path
 
 
+class TrainRecord(namedtuple('TrainRecord', [
+        'train_idx', 'symbol', 'sign', 'length', 'max_spd', 'max_acc',
+        'max_dcc', 'init_time', 'term_time', 'time_pos_list',
+        'rear_time_pos_list', 'pos_spd_list'])):
+    """
+        Archive of a train retired from a TrainList once terminated: its
+        summary and trajectories, without its state in the system.
+        Read like the Train by the plotting and results (terminated,
+        uptrain/downtrain, the *_list records)."""
+    __slots__ = ()
+    terminated = True
+
+    @classmethod
+    def of(cls, trn):
+        return cls(trn.train_idx, trn.symbol, trn.curr_sign, trn.length,
+                   trn.max_spd, trn.max_acc, trn.max_dcc,
+                   getattr(trn, 'init_time', None),
+                   max([time for [time, _] in trn.time_pos_list])
+                   if trn.time_pos_list else None,
+                   trn.time_pos_list, trn.rear_time_pos_list, trn.pos_spd_list)
+
+    @property
+    def uptrain(self):      return self.sign == -1
+
+    @property
+    def downtrain(self):    return self.sign == +1
+
+
 class TrainList(MutableSequence):
     """
         A list-like container for Train instances wihtin a simulation system.
+        Indexed in the order of train_idx (all_trains).
+        Terminated trains are retired by the System (retire): they leave the
+        list for the archive of TrainRecords (retired), see history.
+
+        The uptrains and downtrains are kept in order (Train.__lt__)
+        incrementally: trains report their moves (moved), and are repositioned
+        by swaps with their neighbors on the next access, only when they have
+        passed one. As stable as list.sort(): equal trains keep their order.
         TODO: implement customized attributes of TrainList: 
             append, insert, __getitem__, __setitem__, __delitem__, etc."""
     def __init__(self):
         self._uptrains = []
         self._downtrains = []
+        self._all_trains = []
+        # in the order of train_idx
+        self._same_way = {}
+        # same-way list (_uptrains or _downtrains) of each train
+        self._rank = {}
+        # index of each train in its same-way list
+        self._moved = {}
+        # trains moved since the last access, in the order of their moves
+        self.retired = []
+        # TrainRecords of the retired trains, in the order of retirement
+        self._retired_by_sign = {-1: 0, +1: 0}
+        # number of retired uptrains (-1) and downtrains (+1)
+        self.generated = 0
+        # number of trains ever inserted, the train_idx of the next one
 
     @property
     def uptrains(self):   
-        self._uptrains.sort()
+        self.reorder()
         return self._uptrains
     
     @property
     def downtrains(self):
-        self._downtrains.sort()
+        self.reorder()
         return self._downtrains
 
     @property
     def all_trains(self):
-        _all_trains = self.uptrains + self.downtrains
-        _all_idx = [t.train_idx for t in _all_trains]
-        return [t for _,t in sorted(zip(_all_idx,_all_trains))]
+        return list(self._all_trains)
     
+    @property
+    def history(self):
+        '''
+            All trains ever inserted in the order of train_idx: the
+            TrainRecords of the retired ones and the Trains in the list.'''
+        return sorted(self.retired + self._all_trains,
+                      key=lambda t: t.train_idx)
+
     @property
     def all_trains_by_MP(self):
         _all_MP = [t.curr_MP for t in self.all_trains]
         return [t for _,t in sorted(zip(_all_MP,self.all_trains))]
 
+    def moved(self, trn):
+        '''
+            Report that the train has moved (or terminated): reposition it on
+            the next access.
+            @return: None'''
+        self._moved[trn] = None
+
+    def reorder(self):
+        '''
+            Reposition the moved trains in their same-way lists by swaps with
+            their neighbors, until no neighbors are out of order. Trains
+            displaced by a swap are checked in turn.
+            @return: None'''
+        _work = list(self._moved)
+        self._moved.clear()
+        while _work:
+            trn = _work.pop()
+            if trn not in self._rank:
+                continue
+            _trains, i = self._same_way[trn], self._rank[trn]
+            while i > 0 and trn < _trains[i - 1]:
+                _work.append(self._swap(_trains, i - 1))
+                i -= 1
+            while i < len(_trains) - 1 and _trains[i + 1] < trn:
+                _work.append(self._swap(_trains, i))
+                i += 1
+
+    def _swap(self, trains, i):
+        '''
+            Swap the trains at i and i + 1.
+            @return: the train moved from i + 1 to i'''
+        trains[i], trains[i + 1] = trains[i + 1], trains[i]
+        self._rank[trains[i]], self._rank[trains[i + 1]] = i, i + 1
+        return trains[i]
+
+    def same_way_index(self, trn):
+        '''
+            Index of the train in its same-way list (uptrains or downtrains).'''
+        self.reorder()
+        return self._rank[trn]
+
+    def rank(self, trn):
+        '''
+            Rank of the train among the same-way trains ever inserted: the
+            retired ones, ahead of all, then its same-way list.'''
+        return self._retired_by_sign[trn.curr_sign] + self.same_way_index(trn)
+
+    def retire(self, trn):
+        '''
+            Move a terminated train from the list to the archive (retired).
+            @return: the TrainRecord of the train'''
+        assert trn.terminated
+        _record = TrainRecord.of(trn)
+        del self[self._all_trains.index(trn)]
+        self._moved.pop(trn, None)
+        self.retired.append(_record)
+        self._retired_by_sign[_record.sign] += 1
+        return _record
+
     def __str__(self):
         return str(self.all_trains)
 
@@ -70,28 +187,31 @@ class TrainList(MutableSequence):
 
     def __len__(self):
         """List length"""
-        return len(self.all_trains)
+        return len(self._all_trains)
 
     def __getitem__(self, ii):
-        return self.all_trains[ii]
+        return self._all_trains[ii]
 
     def __delitem__(self, ii):
-        _to_del = self.all_trains[ii]
-        if _to_del in self._uptrains:
-            _idx = self._uptrains.index(_to_del)
-            del self._uptrains[_idx]
-        if _to_del in self._downtrains:
-            _idx = self._downtrains.index(_to_del)
-            del self._downtrains[_idx]
+        _to_del = self._all_trains[ii]
+        self.reorder()
+        self._all_trains.remove(_to_del)
+        _trains = self._same_way.pop(_to_del)
+        del _trains[self._rank.pop(_to_del)]
+        for i, t in enumerate(_trains):
+            self._rank[t] = i
             
     def __setitem__(self, ii, trn):
         raise Exception("Cannot Set Directly in ")
 
     def insert(self, trn):
-        if trn.uptrain:
-            self._uptrains.append(trn)
-        if trn.downtrain:
-            self._downtrains.append(trn)
+        _trains = self._uptrains if trn.uptrain else self._downtrains
+        self._same_way[trn] = _trains
+        self._rank[trn] = len(_trains)
+        _trains.append(trn)
+        self._all_trains.append(trn)
+        self.generated += 1
+        self.moved(trn)
     
     append = insert
 
@@ -129,33 +249,7 @@ class Train():
                 Routing path segment of a train, describing its direction.
             @return:
                 The sign (+1/-1) of train's direction (speed).'''
-        if rp_seg[0][0] and rp_seg[1][0]:
-            if rp_seg[1][0].signal_by_port[rp_seg[1][1]].MP > rp_seg[0][
-                    0].signal_by_port[rp_seg[0][1]].MP:
-                return 1
-            elif rp_seg[1][0].signal_by_port[rp_seg[1][1]].MP < rp_seg[0][
-                    0].signal_by_port[rp_seg[0][1]].MP:
-                return -1
-            else:
-                raise ValueError('Undefined MP direction')
-        elif not rp_seg[0][0]:  # initiating
-            if rp_seg[1][0].signal_by_port[rp_seg[1][1]].MP == \
-                    min(rp_seg[1][0].track_by_port[rp_seg[1][0].opposite_port(rp_seg[1][1])].MP):
-                return 1
-            elif rp_seg[1][0].signal_by_port[rp_seg[1][1]].MP == \
-                    max(rp_seg[1][0].track_by_port[rp_seg[1][0].opposite_port(rp_seg[1][1])].MP):
-                return -1
-            else:
-                raise ValueError('Undefined MP direction')
-        elif not rp_seg[1][0]:  # terminating
-            if rp_seg[0][0].signal_by_port[rp_seg[0][1]].MP == \
-                    max(rp_seg[0][0].track_by_port[rp_seg[0][0].opposite_port(rp_seg[0][1])].MP):
-                return 1
-            elif rp_seg[0][0].signal_by_port[rp_seg[0][1]].MP == \
-                    min(rp_seg[0][0].track_by_port[rp_seg[0][0].opposite_port(rp_seg[0][1])].MP):
-                return -1
-            else:
-                raise ValueError('Undefined MP direction')
+        return Track.sign_routing(rp_seg)
 
     def __init__(self, system, init_segment, dest_segment,
                     max_spd, max_acc, max_dcc, **kwargs):
@@ -171,11 +265,14 @@ class Train():
             if kwargs.get('length') is None else kwargs.get('length')
 
         self._curr_routing_path_segment = self.init_segment
+        self._curr_sign = None
+        # sign of the direction, kept until the segment changes
         self._curr_occupying_routing_path = [self._curr_routing_path_segment]
+        self.update_position()
         self._curr_MP = self.curr_sig.MP
         self._rear_curr_MP = self.curr_MP - self.length * \
-            self.sign_MP(self.curr_routing_path_segment)
-        self.train_idx = len(self.system.trains)
+            self.curr_sign
+        self.train_idx = self.system.trains.generated
         self.symbol = 2 * self.train_idx \
             if self.uptrain else 2 * self.train_idx + 1
         self.system.trains.append(self)
@@ -188,6 +285,10 @@ class Train():
         self._curr_spd_lmt_abs = min(20/3600, self.curr_track.allow_sp) \
             if self.curr_track else min(20/3600, float('inf'))
         self._stopped = True
+        self._idle_version = None
+        self._idle_since = None
+        self._dispatching = False
+        # whether the last request_routing asked its CtrlPoint for a route
 
         self.time_pos_list = []
         self.rear_time_pos_list = []
@@ -201,6 +302,7 @@ class Train():
                     )
                 self.curr_track.train.append(self)
         self.system.last_train_init_time = self.system.sys_time
+        self.system.occupancy_changed(self.curr_track)
 
     def __repr__(self):
         return 'train idx:{} occupying:{} head MP:{} rear MP:{}'\
@@ -218,13 +320,17 @@ class Train():
     @property
     def rank(self):
         '''
-            rank of the train starting from the first train to the last. 
-            First: 0; Last: len(self.system.trains) - 1
+            rank of the train starting from the first train to the last,
+            retired trains included (see TrainList.rank). 
+            First: 0; Last: number of same-way trains ever generated - 1
             TODO: Implement rank for both directions.'''
-        return self.same_way_trains.index(self)
+        return self.system.trains.rank(self)
 
     @property
-    def curr_sign(self):    return self.sign_MP(self.curr_routing_path_segment)
+    def curr_sign(self):
+        if self._curr_sign is None:
+            self._curr_sign = self.sign_MP(self.curr_routing_path_segment)
+        return self._curr_sign
 
     @property
     def uptrain(self):      return True if self.curr_sign == -1 else False
@@ -261,20 +367,116 @@ class Train():
         return self._stopped
 
     @property
-    def curr_track(self):
+    def idle(self):
         '''
-            The current Track instance the head of the train is moving upon'''
-        return self.system.get_track_by_point_port_pairs(
+            Status property shows if the train is stopped with nothing to
+            request, and nothing in the system has changed since then.
+            Idle trains are skipped by System.launch.
+            @return: True or False'''
+        return self._idle_version is not None and \
+            self._idle_version == self.system.state_version
+
+    @property
+    def dispatching(self):
+        '''
+            Status property shows if the last request_routing asked the
+            closest CtrlPoint for a route.
+            @return: True or False'''
+        return self._dispatching
+
+    def set_idle(self):
+        '''
+            Mark the stopped train idle at the current state version of the
+            system. Its records are filled up by resume().
+            Only for trains whose last request_routing did not ask for a route
+            (dispatching): asking draws from the random choices of the
+            Dispatcher, which must not be skipped.
+            @return: None'''
+        self._idle_version = self.system.state_version
+        self._idle_since = self.system.sys_time + self.system.refresh_time
+
+    def resume(self):
+        '''
+            Fill up the time-position records skipped while the train was idle,
+            as if update_acc() had been called at every refreshing cycle.
+            @return: None'''
+        if self._idle_since is not None:
+            _time = self._idle_since + self.system.refresh_time
+            while _time <= self.system.sys_time:
+                self.time_pos_list.append([_time, self.curr_MP])
+                self.rear_time_pos_list.append([_time, self.rear_curr_MP])
+                _time += self.system.refresh_time
+        self._idle_version = None
+        self._idle_since = None
+
+    def derived_position(self):
+        '''
+            Position of the train derived from curr_routing_path_segment and
+            curr_occupying_routing_path through the System lookups.
+            @return: (curr_track, rear_curr_track, curr_tracks,
+                curr_ctrl_point, curr_ctrl_pointport, curr_home_sig, curr_sig)'''
+        _curr_track = self.system.get_track_by_point_port_pairs(
             self.curr_prev_sigpoint, self.curr_prev_sigport, self.curr_sigpoint,
             self.curr_sigport)
+        _rear_curr_track = self.system.get_track_by_point_port_pairs(
+            self.rear_curr_prev_sigpoint, self.rear_curr_prev_sigport,
+            self.rear_curr_sigpoint, self.rear_curr_sigport)
+        _curr_tracks = []
+        for r in self.curr_occupying_routing_path:
+            _track = self.system.get_track_by_point_port_pairs(
+                r[0][0], r[0][1], r[1][0], r[1][1])
+            if _track:
+                _curr_tracks.append(_track)
+        if _curr_track:
+            _curr_ctrl_point = _curr_track.bigblock.shooting_point(
+                sign_MP=self.curr_sign)
+            _curr_ctrl_pointport = _curr_track.bigblock.shooting_port(
+                sign_MP=self.curr_sign)
+        else:
+            _curr_ctrl_point, _curr_ctrl_pointport = \
+                self.curr_sigpoint, self.curr_sigport
+        _curr_home_sig = _curr_ctrl_point.signal_by_port[_curr_ctrl_pointport]\
+            if _curr_ctrl_point else None
+        _curr_sig = self.curr_sigpoint.signal_by_port[self.curr_sigport] \
+            if self.curr_sigpoint else None
+        return (_curr_track, _rear_curr_track, _curr_tracks, _curr_ctrl_point,
+                _curr_ctrl_pointport, _curr_home_sig, _curr_sig)
+
+    def update_position(self):
+        '''
+            Store the position of the train (see derived_position), served by
+            curr_track, rear_curr_track, curr_tracks, curr_ctrl_point,
+            curr_ctrl_pointport, curr_home_sig and curr_sig until the head or
+            the rear crosses the next signal point.
+            @return: None'''
+        (self._curr_track, self._rear_curr_track, self._curr_tracks,
+         self._curr_ctrl_point, self._curr_ctrl_pointport, self._curr_home_sig,
+         self._curr_sig) = self.derived_position()
+        self.system.trains.moved(self)
+
+    def audit_position(self):
+        '''
+            Check the stored position against derived_position.
+            Called every refreshing cycle with System(..., audit_positions=True).
+            @return: None'''
+        _stored = (self._curr_track, self._rear_curr_track, self._curr_tracks,
+                   self._curr_ctrl_point, self._curr_ctrl_pointport,
+                   self._curr_home_sig, self._curr_sig)
+        assert _stored == self.derived_position(), \
+            'Stale position of train {}: stored {}, derived {}'.format(
+                self.train_idx, _stored, self.derived_position())
+
+    @property
+    def curr_track(self):
+        '''
+            The current Track instance the head of the train is moving upon'''
+        return self._curr_track
 
     @property
     def rear_curr_track(self):
         '''
             The current Track instance the rear of the train is moving upon'''
-        return self.system.get_track_by_point_port_pairs(
-            self.rear_curr_prev_sigpoint, self.rear_curr_prev_sigport,
-            self.rear_curr_sigpoint, self.rear_curr_sigport)
+        return self._rear_curr_track
 
     @property
     def curr_occupying_routing_path(self):
@@ -289,13 +491,7 @@ class Train():
         '''
             A list of Track instances being occupied by the train.
             The Track instances are in order from train head to rear.'''
-        _curr_tracks = []
-        for r in self.curr_occupying_routing_path:
-            _track = self.system.get_track_by_point_port_pairs(
-                r[0][0], r[0][1], r[1][0], r[1][1])
-            if _track:
-                _curr_tracks.append(_track)
-        return _curr_tracks
+        return list(self._curr_tracks)
 
     @property
     def curr_bigblock_routing(self):
@@ -348,6 +544,7 @@ class Train():
             Once set, the direction of the train & occupied track are confined.'''
         assert isinstance(new_segment, tuple) and len(new_segment) == 2
         self._curr_routing_path_segment = new_segment
+        self._curr_sign = None
 
     @property
     def all_paths_ahead(self):
@@ -418,23 +615,19 @@ class Train():
     def curr_ctrl_point(self):
         '''
             The closest CtrlPoint instance the train head is moving towards.'''
-        return self.curr_track.bigblock.shooting_point(sign_MP=self.sign_MP(self.curr_routing_path_segment))\
-            if self.curr_track else self.curr_sigpoint
+        return self._curr_ctrl_point
 
     @property
     def curr_ctrl_pointport(self):
         '''
             The port of curr_ctrl_point the train head is moving towards.'''
-        return self.curr_track.bigblock.shooting_port(sign_MP=self.sign_MP(self.curr_routing_path_segment))\
-            if self.curr_track else self.curr_sigport
+        return self._curr_ctrl_pointport
 
     @property
     def curr_home_sig(self):
         '''
             The closest HomeSignal instance the train head is moving towards.'''
-        return self.curr_ctrl_point.signal_by_port[self.curr_ctrl_pointport]\
-            if self.curr_ctrl_point\
-            else None
+        return self._curr_home_sig
 
     @property
     def curr_route_cancelable(self):
@@ -447,9 +640,7 @@ class Train():
     def curr_sig(self):
         '''
             The Signal instance the train head is moving towards.'''
-        return self.curr_sigpoint.signal_by_port[self.curr_sigport] \
-            if self.curr_sigpoint \
-            else None
+        return self._curr_sig
 
     @property
     def rear_curr_sig(self):
@@ -508,6 +699,7 @@ class Train():
         self.rear_curr_MP = self.rear_curr_MP + _delta_s
         # set the new rear MP using the same delta_s
         self.time_pos_list.append([self.system.sys_time, self.curr_MP])
+        self.system.trains.moved(self)
 
     @property
     def rear_curr_MP(self):  # in miles
@@ -682,7 +874,7 @@ class Train():
                         2.2.2.3 if target speed <= current speed and the target speed < current speed limit,
                             decelerate at maximum effort to cross the signal.
                         '''
-        _direction_sign = self.sign_MP(self.curr_routing_path_segment)
+        _direction_sign = self.curr_sign
         # sign of traveling direction (MP increment)
         _delta_s = self.curr_speed * self.system.refresh_time + \
             0.5 * self._curr_acc * self.system.refresh_time ** 2
@@ -832,7 +1024,8 @@ class Train():
 
     @property
     def trn_follow_behind(self):
-        return self.same_way_trains[self.rank + 1]
+        return self.same_way_trains[
+            self.system.trains.same_way_index(self) + 1]
 
     @property
     def dist_to_trn_behind(self): 
@@ -947,6 +1140,8 @@ class Train():
         else:
             raise Exception('{} crossing {} failed unexpectedly'
                             .format(self, sigpoint))
+        self.update_position()
+        self.system.occupancy_changed(None if terminate else _permit_track)
 
     def rear_cross_sigpoint(self, sigpoint, rear_curr_MP, new_rear_MP):
         '''
@@ -970,9 +1165,12 @@ class Train():
         # self.rear_time_pos_list.append([timestamp, self.rear_curr_sig.MP])
 
         del sigpoint.curr_train_with_route[self]
-        if self.rear_curr_track:
-            self.rear_curr_track.train.remove(self)
+        _rear_curr_track = self.rear_curr_track
+        if _rear_curr_track:
+            _rear_curr_track.train.remove(self)
         self.curr_occupying_routing_path.pop(-1)
+        self.update_position()
+        self.system.occupancy_changed(_rear_curr_track)
         # TODO:----dispatching logic may need to modify here
         # ---------to determine if further bigblock actions are needed
 
@@ -1006,7 +1204,7 @@ class Train():
         if not self.hold_speed_before_dcc(MP, tgt_MP, spd, tgt_spd):
             return False
         else:
-            _direction_sign = self.sign_MP(self.curr_routing_path_segment)
+            _direction_sign = self.curr_sign
             delta_s = spd * self.system.refresh_time + 0.5 * \
                 (_direction_sign*self.max_acc) * self.system.refresh_time**2
             delta_spd = (_direction_sign * self.max_acc) * \
@@ -1049,14 +1247,16 @@ class Train():
             Method of the train to call the closest CtrlPoint to clear a route. 
             Serve the myopic dispatch logic where trains only calls the cloest CPs.
             @return: None'''
-        if self.pending_route and self.any_paths_ahead_enterable:
+        self._dispatching = bool(self.pending_route and
+                                 self.any_paths_ahead_enterable)
+        if self._dispatching:
             _pending_route_to_open = \
                 self.curr_ctrl_point.find_route_for_port(
                                             port=self.curr_ctrl_pointport,
                                             dest_pointport=self.dest_pointport)
             if _pending_route_to_open is None:
                 return
-            if _pending_route_to_open not in self.curr_ctrl_point.current_invalid_routes:
+            if not self.curr_ctrl_point.is_invalid_route(_pending_route_to_open):
                 if not self.curr_track or not self.curr_track.yard:
                     print('{}, requested {} at {}'
                     .format(self, _pending_route_to_open, 
@@ -1089,7 +1289,8 @@ class Train():
             TODO: implement better judgment to consider more conditions, such as
                 priority, proximity (to the follower), etc.'''
         # the last train is not passable by any train
-        if self.rank == len(self.same_way_trains) - 1:
+        if self.system.trains.same_way_index(self) == \
+                len(self.same_way_trains) - 1:
             return False
         # for any train that is not the last one:
         if not self.curr_track or not self.rear_curr_track: